@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark and regression check for the post renderer.
+
+Renders every post of fixtures/posts_corpus.json (raw channel posts, among
+them unbalanced **, _ in URLs, < and &, nested links and unclosed code) or
+of a TinyDB data file with core.getting_data.render_post, checks that each
+result is valid Telegram HTML and reports the throughput.
+
+Usage:
+    python benchmark_markdown.py                       # fixtures/posts_corpus.json
+    python benchmark_markdown.py data_json/data.json   # stored posts
+"""
+
+import json
+import re
+import sys
+import time
+from html.parser import HTMLParser
+
+from core.getting_data import render_post
+from core.post_parser import PostParseError, parse_post
+
+CORPUS_PATH = "fixtures/posts_corpus.json"
+
+ALLOWED_TAGS = {"b", "i", "s", "u", "code", "pre", "a"}
+BAD_AMPERSAND_RE = re.compile(r"&(?!(?:amp|lt|gt|quot);)")
+
+
+class TelegramHTMLValidator(HTMLParser):
+    """Collects the problems Telegram would reject a message for."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            self.errors.append(f"unsupported tag <{tag}>")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            self.errors.append(f"unbalanced </{tag}>")
+        else:
+            self.stack.pop()
+
+    def close(self):
+        super().close()
+        if self.stack:
+            self.errors.append(f"unclosed tags {self.stack}")
+
+
+def validate(rendered):
+    validator = TelegramHTMLValidator()
+    validator.feed(rendered)
+    validator.close()
+    if BAD_AMPERSAND_RE.search(rendered):
+        validator.errors.append("unescaped &")
+    return validator.errors
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    if "posts" not in content:
+        # TinyDB data file
+        return list(content.get("data", {}).values())
+    posts = []
+    for number, text in enumerate(content["posts"]):
+        try:
+            post = parse_post(text)
+        except PostParseError:
+            continue
+        post["url"] = "https://t.me/UstozShogird"
+        post["message_id"] = number
+        posts.append(post)
+    return posts
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS_PATH
+    corpus = load_corpus(path)
+
+    failures = 0
+    for post in corpus:
+        errors = validate(render_post(post))
+        if errors:
+            failures += 1
+            print(f"❌ message {post.get('message_id')}: {', '.join(errors)}")
+
+    rounds = max(1, 20000 // len(corpus))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for post in corpus:
+            render_post(post)
+    elapsed = time.perf_counter() - start
+    rendered = rounds * len(corpus)
+
+    print(f"Posts checked: {len(corpus)}, invalid: {failures}")
+    print(
+        f"Rendered {rendered} posts in {elapsed:.3f}s "
+        f"({rendered / elapsed:,.0f} posts/s, {elapsed / rendered * 1e6:.1f} µs/post)"
+    )
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
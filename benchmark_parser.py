@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the post parser of the backfill.
+
+Parses every raw post of fixtures/posts_corpus.json (or of a TinyDB data
+file, rebuilt from its stored parts) with core.post_parser.parse_post,
+reports the parse failures by reason and compares the throughput with the
+old text.split("\\n\\n") + to_json parsing.
+
+Usage:
+    python benchmark_parser.py                       # fixtures/posts_corpus.json
+    python benchmark_parser.py data_json/data.json   # stored posts
+"""
+
+import json
+import sys
+import time
+from collections import Counter
+
+from core.getting_data import to_json
+from core.post_parser import PostParseError, parse_post
+
+CORPUS_PATH = "fixtures/posts_corpus.json"
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        content = json.load(f)
+    if "posts" in content:
+        return content["posts"]
+    # TinyDB data file: put the stored parts back together
+    return [
+        "\n\n".join([doc["needs"], doc["text"], " ".join(doc["hashtags"]), doc["url"]])
+        for doc in content.get("data", {}).values()
+    ]
+
+
+def legacy_parse(text):
+    lst = text.split("\n\n")
+    if len(lst) < 4:
+        return None
+    return to_json(lst)
+
+
+def bench(parse, corpus):
+    rounds = max(1, 50000 // len(corpus))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            try:
+                parse(text)
+            except PostParseError:
+                pass
+    elapsed = time.perf_counter() - start
+    return rounds * len(corpus), elapsed
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS_PATH
+    corpus = load_corpus(path)
+
+    failures = Counter()
+    for text in corpus:
+        try:
+            parse_post(text)
+        except PostParseError as e:
+            failures[e.reason] += 1
+
+    print(f"Posts: {len(corpus)}, parse failures: {sum(failures.values())}")
+    for reason, count in failures.most_common():
+        print(f"  {reason}: {count}")
+
+    for name, parse in (("parse_post", parse_post), ("split + to_json", legacy_parse)):
+        parsed, elapsed = bench(parse, corpus)
+        print(
+            f"{name:>16}: {parsed} posts in {elapsed:.3f}s "
+            f"({parsed / elapsed:,.0f} posts/s, {elapsed / parsed * 1e6:.1f} µs/post)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,31 +14,32 @@ bot.
 from pprint import pprint
 
 import os
+import sys
 import asyncio
+import html
+import time
 from dotenv import load_dotenv
-from tinydb import TinyDB, Query
 
-from core.getting_data import to_text
-
-userdb = TinyDB("data_json/user.json", indent=4, separators=(",", ": "))
-datadb = TinyDB(
-    "data_json/data.json", indent=4, separators=(",", ": "), encoding="utf-8"
-)
-hashdb = TinyDB(
-    "data_json/hashtag.json", sort_keys=True, indent=4, separators=(",", ": ")
-)
-
-Data = Query()
-data = datadb.table("data")
-User = Query()
-user_table = userdb.table("user")
-
-Hashtag = Query()
-hash_table = hashdb.table("hashtag")
+from core.delivery import scheduler
+from core.getting_data import markdown_to_html, post_link
+from core.hashtag_stats import hashtag_stats
+from core.hashtags import hashtag_aliases
+from core.post_index import post_index
+from core.query import QuerySyntaxError, compile_query, format_query
+from core.rendering import render_cache
+from core.repository import get_repository
+from core.search_cursors import SearchCursor, search_cursors
+from core.subscription_index import subscription_index
+from core.text_index import text_index
+from core.trending import trending
 
 load_dotenv()
 
 TOKEN = os.getenv("BOT_TOKEN")
+# Telegram user ids allowed to edit the hashtag aliases, comma separated
+ADMIN_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()
+}
 
 import logging
 
@@ -49,6 +50,7 @@ from telegram import (
     ReplyKeyboardMarkup,
     Update,
 )
+from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -67,11 +69,78 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger(__name__)
 
+TEXT_PAGE_SIZE = 5
+# Message ids fetched from the index at a time while paging search results
+SEARCH_BATCH_SIZE = 20
+# Date ranges of the search keyboard: label and length in seconds
+SEARCH_RANGES = {
+    "any": ("Any time", None),
+    "day": ("Last day", 24 * 3600),
+    "week": ("Last week", 7 * 24 * 3600),
+    "month": ("Last month", 30 * 24 * 3600),
+}
+TEXT_PREVIEW_LENGTH = 120
+
+
+def refresh_subscription(repository, user_id) -> None:
+    """Re-index a user's subscription after it changed."""
+    subscription_index.update_user(repository.get_user(user_id))
+
+
+def stored_hashtags(user_data) -> set:
+    """A user's hashtags in canonical form, also those saved before aliases."""
+    return set(hashtag_aliases.canonical_all(user_data.get("hashtags", [])))
+
+
+HASHTAG_WINDOWS = {
+    "all": "🏆 All time",
+    "24h": "🔥 24h",
+    "7d": "🔥 7d",
+    "30d": "🔥 30d",
+}
+_hashtag_markups = {}
+
+
+def top_hashtags_markup(window="all") -> InlineKeyboardMarkup:
+    """
+    Keyboard of the 10 most used hashtags of all time or of a trending window,
+    rebuilt only when they change.
+    """
+    if window == "all":
+        stats_version = hashtag_stats.refresh()
+    else:
+        stats_version = trending.refresh()
+    version, markup = _hashtag_markups.get(window, (None, None))
+    if version != stats_version or markup is None:
+        # most 10 used hashtags
+        if window == "all":
+            most_hashtags = hashtag_stats.top(10)
+            stats_version = hashtag_stats.version
+        else:
+            most_hashtags = trending.top(window, 10)
+        keyboard = [
+            [InlineKeyboardButton(hashtag, callback_data=hashtag)]
+            for hashtag, _ in most_hashtags
+        ]
+        keyboard.append(
+            [
+                InlineKeyboardButton(
+                    f"• {label}" if name == window else label,
+                    callback_data=f"trend_{name}",
+                )
+                for name, label in HASHTAG_WINDOWS.items()
+            ]
+        )
+        markup = InlineKeyboardMarkup(keyboard)
+        _hashtag_markups[window] = (stats_version, markup)
+    return markup
+
 
 # Define a few command handlers. These usually take the two arguments update and
 # context.
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
 
     # save user data
@@ -83,8 +152,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "hashtags": [],
     }
     # check if user exists
-    if not user_table.get(User.id == user.id):
-        user_table.insert(user_data)
+    if not repository.get_user(user.id):
+        repository.insert_user(user_data)
 
     keyboard = [
         [
@@ -115,25 +184,17 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def hashtag_keyboards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends inline keyboard contains hashtags."""
-    search = hash_table.search(Hashtag.hashtag.exists())
-    search.sort(key=lambda x: x["count"], reverse=True)
-    # most 10 used hashtags
-    most_hashtags = search[:10]
-
-    keyboard = [
-        [InlineKeyboardButton(hashtag["hashtag"], callback_data=hashtag["hashtag"])]
-        for hashtag in most_hashtags
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    repository = context.bot_data["repository"]
+    reply_markup = top_hashtags_markup()
 
     # get hashtags
     user = update.effective_user
-    user_hashtags = user_table.get(User.id == user.id)["hashtags"]
+    user_hashtags = repository.get_user(user.id)["hashtags"]
 
     await update.message.reply_text(
         f"""Currently hashtags: {" ".join(user_hashtags)}
 You can choose one of these by tapping, or delete if it exists.
+Switch to 🔥 to see what is trending in the last 24h, 7d or 30d.
 You can also add your own hashtag by typing: #yourOwnHashtag,""",
         reply_markup=reply_markup,
     )
@@ -143,9 +204,10 @@ async def my_hashtag_keyboards(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Sends inline keyboard contains hashtags."""
+    repository = context.bot_data["repository"]
     # get user hashtags
     user = update.effective_user
-    user_hashtags = user_table.get(User.id == user.id)["hashtags"]
+    user_hashtags = repository.get_user(user.id)["hashtags"]
 
     keyboard = [
         [InlineKeyboardButton(hashtag, callback_data="my" + hashtag)]
@@ -156,7 +218,7 @@ async def my_hashtag_keyboards(
 
     # get hashtags
     user = update.effective_user
-    user_hashtags = user_table.get(User.id == user.id)["hashtags"]
+    user_hashtags = repository.get_user(user.id)["hashtags"]
 
     if len(user_hashtags) == 0:
         await update.message.reply_text(
@@ -170,6 +232,7 @@ async def my_hashtag_keyboards(
 
 async def add_hashtag(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Add hashtag to user hashtags."""
+    repository = context.bot_data["repository"]
     text = update.message.text
 
     # check text has valid hashtag
@@ -178,30 +241,30 @@ async def add_hashtag(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
 
     # if multiple hashtags
-    user = update.effective_user
-    user_hashtags = set(user_table.get(User.id == user.id)["hashtags"])
-
-    if " " in text:
-        hashtags = text.split()
-        for hashtag in hashtags:
-            if hashtag.startswith("#"):
-                user_hashtags.add(hashtag)
-            else:
-                continue
+    hashtags = hashtag_aliases.canonical_all(
+        hashtag for hashtag in text.split() if hashtag.startswith("#")
+    )
+    if not hashtags:
+        await update.message.reply_text("Please enter a valid hashtag")
+        return
 
-    user_hashtags.add(update.message.text)
+    user = update.effective_user
+    user_hashtags = stored_hashtags(repository.get_user(user.id))
+    user_hashtags.update(hashtags)
     # convert set to list
     user_hashtags = list(user_hashtags)
-    user_table.update({"hashtags": user_hashtags}, User.id == user.id)
-    await update.message.reply_text(f"Hashtag {update.message.text} added")
+    repository.update_user(user.id, {"hashtags": user_hashtags})
+    refresh_subscription(repository, user.id)
+    await update.message.reply_text(f"Hashtag {' '.join(hashtags)} added")
 
 
 async def remove_hashtag_keyboards(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Sends inline keyboard to remove hashtags."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
-    user_hashtags = user_table.get(User.id == user.id)["hashtags"]
+    user_hashtags = repository.get_user(user.id)["hashtags"]
 
     if len(user_hashtags) == 0:
         await update.message.reply_text("You have no hashtags to remove.")
@@ -233,27 +296,30 @@ Tap a hashtag to remove it, or remove all at once:""",
 
 async def remove_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle hashtag removal from callback."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
     await query.answer()
 
-    user_data = user_table.get(User.id == user.id)
-    user_hashtags = set(user_data.get("hashtags", []))
+    user_data = repository.get_user(user.id)
+    user_hashtags = stored_hashtags(user_data)
 
     if query.data == "remove_all":
         # Remove all hashtags
-        user_table.update({"hashtags": []}, User.id == user.id)
+        repository.update_user(user.id, {"hashtags": []})
+        refresh_subscription(repository, user.id)
         await query.edit_message_text("✅ All hashtags have been removed!")
         return
 
     # Extract hashtag from callback data "remove#hashtag"
-    hashtag = query.data[6:]  # Remove "remove" prefix
+    hashtag = hashtag_aliases.canonical(query.data[6:])  # Remove "remove" prefix
 
     if hashtag in user_hashtags:
         user_hashtags.remove(hashtag)
         user_hashtags = list(user_hashtags)
-        user_table.update({"hashtags": user_hashtags}, User.id == user.id)
+        repository.update_user(user.id, {"hashtags": user_hashtags})
+        refresh_subscription(repository, user.id)
 
         if len(user_hashtags) == 0:
             await query.edit_message_text(
@@ -290,44 +356,89 @@ Tap a hashtag to remove it, or remove all at once:""",
         await query.answer("Hashtag not found!", show_alert=True)
 
 
-async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show search options to user."""
-    user = update.effective_user
-    user_data = user_table.get(User.id == user.id)
-    user_hashtags = user_data["hashtags"]
-
-    if len(user_hashtags) == 0:
-        await update.message.reply_text(
-            "You have no hashtags. Please add hashtags first"
+def search_keyboard(selected_range):
+    """Search limit options with a row of date ranges, the selected one ticked."""
+    ranges = [
+        InlineKeyboardButton(
+            f"✅ {label}" if name == selected_range else label,
+            callback_data=f"range_{name}",
         )
-        return
-
-    # Create keyboard with search limit options
+        for name, (label, _) in SEARCH_RANGES.items()
+    ]
     keyboard = [
+        ranges,
         [InlineKeyboardButton("10 messages", callback_data="search_10")],
         [InlineKeyboardButton("25 messages", callback_data="search_25")],
         [InlineKeyboardButton("50 messages", callback_data="search_50")],
         [InlineKeyboardButton("100 messages", callback_data="search_100")],
         [InlineKeyboardButton("All messages", callback_data="search_all")],
+        [InlineKeyboardButton("📝 Search by text", callback_data="textsearch")],
     ]
+    return InlineKeyboardMarkup(keyboard)
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
 
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show search options to user."""
+    repository = context.bot_data["repository"]
+    user = update.effective_user
+    user_data = repository.get_user(user.id)
+    user_hashtags = user_data["hashtags"]
     match_mode = user_data.get("match_mode", "any")
+
+    text_search_markup = InlineKeyboardMarkup(
+        [[InlineKeyboardButton("📝 Search by text", callback_data="textsearch")]]
+    )
+    if match_mode == "query":
+        if not user_data.get("query"):
+            await update.message.reply_text(
+                "You have no query. Please set one with /query first, "
+                "or search the posts by text",
+                reply_markup=text_search_markup,
+            )
+            return
+    elif len(user_hashtags) == 0:
+        await update.message.reply_text(
+            "You have no hashtags. Please add hashtags first, "
+            "or search the posts by text",
+            reply_markup=text_search_markup,
+        )
+        return
+
+    reply_markup = search_keyboard(context.user_data.get("search_range", "any"))
+
+    if match_mode == "query":
+        subscription = f"*Your query:* {user_data['query']}"
+    else:
+        subscription = f"*Your hashtags:* {' '.join(user_hashtags)}"
     await update.message.reply_text(
         f"""🔍 *Search Messages*
 
 *Current mode:* {match_mode.upper()}
-*Your hashtags:* {' '.join(user_hashtags)}
+{subscription}
 
-How many recent messages do you want to search?""",
+How many recent messages do you want to browse?""",
         reply_markup=reply_markup,
         parse_mode="Markdown",
     )
 
 
+async def search_range_button(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Select the date range of the next search."""
+    query = update.callback_query
+    await query.answer()
+
+    selected_range = query.data.split("_")[1]
+    if selected_range not in SEARCH_RANGES:
+        return
+    context.user_data["search_range"] = selected_range
+    await query.edit_message_reply_markup(search_keyboard(selected_range))
+
+
 async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Perform the actual search with selected limit."""
+    """Open a cursor over the newest matches and show the first one."""
+    repository = context.bot_data["repository"]
     query = update.callback_query
     user = update.effective_user
 
@@ -337,195 +448,207 @@ async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     limit_str = query.data.split("_")[1]
     limit = None if limit_str == "all" else int(limit_str)
 
-    user_data = user_table.get(User.id == user.id)
-    user_hashtags = user_data["hashtags"]
+    user_data = repository.get_user(user.id)
     match_mode = user_data.get("match_mode", "any")
+    label, period = SEARCH_RANGES.get(
+        context.user_data.get("search_range", "any"), SEARCH_RANGES["any"]
+    )
+    since = None if period is None else int(time.time() - period)
 
-    # Get data according to hashtags and match mode
-    if match_mode == "advanced":
-        # Advanced mode: (ALL required) AND (ANY optional)
-        required_tags = user_data.get("required_hashtags", [])
-        optional_tags = user_data.get("optional_hashtags", [])
-
-        # Get all data first
-        all_data = data.all()
-        search = []
-
-        for item in all_data:
-            item_hashtags = item.get("hashtags", [])
-
-            # Check required hashtags (all must be present)
-            required_match = (
-                all(tag in item_hashtags for tag in required_tags)
-                if required_tags
-                else True
-            )
+    # Only the first batch of ids is fetched, the rest when paging further
+    post_index.sync(repository)
+    batch = SEARCH_BATCH_SIZE if limit is None else min(limit, SEARCH_BATCH_SIZE)
+    message_ids = post_index.newest(user_data, batch, since=since)
 
-            # Check optional hashtags (at least one must be present)
-            optional_match = (
-                any(tag in item_hashtags for tag in optional_tags)
-                if optional_tags
-                else True
-            )
+    if len(message_ids) == 0:
+        await query.edit_message_text(
+            f"❌ No data found with match mode: {match_mode.upper()} ({label})"
+        )
+        return
 
-            # Both conditions must be met
-            if required_match and optional_match:
-                search.append(item)
-    elif match_mode == "all":
-        search = data.search(Data.hashtags.all(user_hashtags))
-    else:
-        search = data.search(Data.hashtags.any(user_hashtags))
+    cursor = SearchCursor(
+        user_data,
+        message_ids,
+        limit,
+        exhausted=len(message_ids) < batch,
+        title=f"{match_mode.upper()}, {label}",
+        since=since,
+    )
+    search_cursors.put(user.id, cursor)
+    await show_search_page(query, repository, cursor)
 
-    # Sort by most recent (assuming there's a timestamp or ID field)
-    # If your data has a timestamp, sort by it. Otherwise, reverse to get most recent
-    search = list(reversed(search))
 
-    # Apply limit
-    if limit:
-        search = search[:limit]
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Move the search cursor to another result."""
+    repository = context.bot_data["repository"]
+    query = update.callback_query
+    await query.answer()
 
-    if len(search) == 0:
-        await query.edit_message_text(
-            f"❌ No data found with match mode: {match_mode.upper()}"
-        )
+    cursor = search_cursors.get(update.effective_user.id)
+    if cursor is None:
+        await query.edit_message_text("Search expired, please search again.")
         return
 
-    # Store search context for stop functionality
-    context.user_data["searching"] = True
-    context.user_data["search_total"] = len(search)
-    context.user_data["search_sent"] = 0
-
-    # Create stop button
-    stop_keyboard = [
-        [InlineKeyboardButton("🛑 Stop Search", callback_data="stop_search")]
-    ]
-    stop_markup = InlineKeyboardMarkup(stop_keyboard)
+    position = int(query.data.split("_")[1])
+    if position >= len(cursor.ids) and not cursor.exhausted:
+        # Fetch the next batch of older matches after the last one fetched
+        wanted = SEARCH_BATCH_SIZE
+        if cursor.limit is not None:
+            wanted = min(wanted, cursor.limit - len(cursor.ids))
+        post_index.sync(repository)
+        older = post_index.newest(
+            cursor.user, wanted, before=cursor.ids[-1], since=cursor.since
+        )
+        cursor.ids.extend(older)
+        cursor.exhausted = len(older) < wanted
+    cursor.position = min(max(position, 0), len(cursor.ids) - 1)
+    await show_search_page(query, repository, cursor)
+
+
+async def show_search_page(query, repository, cursor):
+    """Edit the search message to show the post under the cursor."""
+    position = cursor.position
+    if cursor.limit is not None and len(cursor.ids) >= cursor.limit:
+        cursor.exhausted = True
+
+    posts = repository.get_posts([cursor.ids[position]])
+    if posts:
+        rendered = render_cache.get(posts[0])
+        text, parse_mode = rendered.text, rendered.parse_mode
+    else:
+        text, parse_mode = "This post is no longer available.", None
+
+    more = "" if cursor.exhausted else "+"
+    header = f"🔍 {cursor.title}: {position + 1}/{len(cursor.ids)}{more}"
+    buttons = []
+    if position > 0:
+        buttons.append(
+            InlineKeyboardButton("⬅️ Prev", callback_data=f"page_{position - 1}")
+        )
+    if position < len(cursor.ids) - 1 or not cursor.exhausted:
+        buttons.append(
+            InlineKeyboardButton("Next ➡️", callback_data=f"page_{position + 1}")
+        )
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
 
-    status_message = await query.edit_message_text(
-        f"🔍 Searching with mode: {match_mode.upper()}\nFound {len(search)} results\nSending messages...",
-        reply_markup=stop_markup,
+    await query.edit_message_text(
+        f"{header}\n\n{text}",
+        reply_markup=reply_markup,
+        parse_mode=parse_mode,
     )
 
-    context.user_data["status_message_id"] = status_message.message_id
-    context.user_data["status_chat_id"] = query.message.chat_id
 
-    sent_count = 0
-    for dct in search:
-        # Check if user stopped the search
-        if not context.user_data.get("searching", False):
-            break
+def text_results_page(repository, words, message_ids, page):
+    """One page of ranked text search results and its navigation buttons."""
+    pages = max(1, -(-len(message_ids) // TEXT_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * TEXT_PAGE_SIZE
+    posts = repository.get_posts(message_ids[start : start + TEXT_PAGE_SIZE])
 
-        from core.getting_data import (
-            clean_markdown_for_telegram,
-            remove_all_markdown,
+    lines = [
+        f"📝 <b>{html.escape(words)}</b>: {len(message_ids)} results, "
+        f"page {page + 1}/{pages}"
+    ]
+    for number, post in enumerate(posts, start + 1):
+        title = markdown_to_html(post.get("needs", "").strip()) or "Post"
+        body = post.get("text", "").strip().split("\n")
+        preview = html.escape(" ".join(body[:2])[:TEXT_PREVIEW_LENGTH])
+        lines.append(
+            f'\n<b>{number}.</b> <a href="{post_link(post)}">{title}</a>\n{preview}'
         )
 
-        text = to_text(dct)
-        cleaned_text = clean_markdown_for_telegram(str(text))
+    buttons = []
+    if page > 0:
+        buttons.append(
+            InlineKeyboardButton("⬅️ Prev", callback_data=f"textpage_{page - 1}")
+        )
+    if page < pages - 1:
+        buttons.append(
+            InlineKeyboardButton("Next ➡️", callback_data=f"textpage_{page + 1}")
+        )
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return "\n".join(lines), markup
 
-        try:
-            try:
-                await context.bot.send_message(
-                    user.id,
-                    text=cleaned_text,
-                    parse_mode="Markdown",
-                )
-            except Exception as parse_error:
-                # If markdown parsing fails, send as plain text
-                plain_text = remove_all_markdown(str(text))
-                await context.bot.send_message(user.id, text=plain_text)
-                logger.info(
-                    f"Sent plain text message to user {user.id} due to markdown error"
-                )
 
-            sent_count += 1
-            context.user_data["search_sent"] = sent_count
-
-            # Update status every 5 messages
-            if sent_count % 5 == 0:
-                try:
-                    await context.bot.edit_message_text(
-                        chat_id=context.user_data["status_chat_id"],
-                        message_id=context.user_data["status_message_id"],
-                        text=f"🔍 Searching with mode: {match_mode.upper()}\nSent {sent_count}/{len(search)} messages...",
-                        reply_markup=stop_markup,
-                    )
-                except Exception:
-                    pass  # Ignore if message is too old to edit
+async def text_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ask for the words of a text search."""
+    query = update.callback_query
+    await query.answer()
+    context.user_data["awaiting_text_search"] = True
+    await query.edit_message_text(
+        "📝 Send the words to search for, for example: django remote junior"
+    )
 
-            # Small delay to avoid flooding
-            await asyncio.sleep(0.5)
-        except Exception as e:
-            logger.error(f"error {e}")
 
-    # Final status update
-    context.user_data["searching"] = False
-    try:
-        if sent_count == len(search):
-            await context.bot.edit_message_text(
-                chat_id=context.user_data["status_chat_id"],
-                message_id=context.user_data["status_message_id"],
-                text=f"✅ Search completed!\nSent {sent_count}/{len(search)} messages",
-            )
-        else:
-            await context.bot.edit_message_text(
-                chat_id=context.user_data["status_chat_id"],
-                message_id=context.user_data["status_message_id"],
-                text=f"🛑 Search stopped by user\nSent {sent_count}/{len(search)} messages",
-            )
-    except Exception:
-        pass
+async def text_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Run a text search with the words the user sent."""
+    if not context.user_data.pop("awaiting_text_search", False):
+        return
+    repository = context.bot_data["repository"]
+    words = update.message.text.strip()
 
+    text_index.sync(repository)
+    message_ids = text_index.search(words)
+    if not message_ids:
+        await update.message.reply_text(f"❌ No posts found for: {words}")
+        return
 
-async def stop_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Stop the ongoing search."""
-    query = update.callback_query
-    await query.answer("Stopping search...", show_alert=True)
+    context.user_data["text_search"] = {"words": words, "ids": message_ids}
+    text, markup = text_results_page(repository, words, message_ids, 0)
+    await update.message.reply_text(
+        text,
+        reply_markup=markup,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
 
-    context.user_data["searching"] = False
 
-    sent = context.user_data.get("search_sent", 0)
-    total = context.user_data.get("search_total", 0)
+async def text_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show another page of the last text search."""
+    repository = context.bot_data["repository"]
+    query = update.callback_query
+    await query.answer()
 
-    try:
-        await query.edit_message_text(
-            f"🛑 Search stopped!\nSent {sent}/{total} messages"
-        )
-    except Exception:
-        pass
+    results = context.user_data.get("text_search")
+    if not results:
+        await query.edit_message_text("Search expired, please search again.")
+        return
+
+    page = int(query.data.split("_")[1])
+    text, markup = text_results_page(repository, results["words"], results["ids"], page)
+    await query.edit_message_text(
+        text,
+        reply_markup=markup,
+        parse_mode=ParseMode.HTML,
+        disable_web_page_preview=True,
+    )
 
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Parses the CallbackQuery and updates the message text."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
-    search = hash_table.search(Hashtag.hashtag.exists())
-    search.sort(key=lambda x: x["count"], reverse=True)
-    # most 10 used hashtags
-    most_hashtags = search[:10]
-
-    keyboard = [
-        [InlineKeyboardButton(hashtag["hashtag"], callback_data=hashtag["hashtag"])]
-        for hashtag in most_hashtags
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Keep the keyboard (all time or trending) the user is looking at
+    reply_markup = query.message.reply_markup or top_hashtags_markup()
 
     # CallbackQueries need to be answered, even if no notification to the user is needed
     # Some clients may have trouble otherwise. See https://core.telegram.org/bots/api#callbackquery
     await query.answer()
     logger.info(query.data)
-    user_hashtags = set(user_table.get(User.id == user.id)["hashtags"])
+    user_hashtags = stored_hashtags(repository.get_user(user.id))
 
-    if query.data != "done":
-        if query.data in user_hashtags:
-            user_hashtags.remove(query.data)
+    hashtag = hashtag_aliases.canonical(query.data)
+    if query.data != "done" and hashtag:
+        if hashtag in user_hashtags:
+            user_hashtags.remove(hashtag)
         else:
-            user_hashtags.add(query.data)
+            user_hashtags.add(hashtag)
 
         user_hashtags = list(user_hashtags)
-        user_table.update({"hashtags": user_hashtags}, User.id == user.id)
+        repository.update_user(user.id, {"hashtags": user_hashtags})
+        refresh_subscription(repository, user.id)
         await query.edit_message_text(
             text=f"Selected option: {' '.join(user_hashtags)}",
             reply_markup=reply_markup,
@@ -534,24 +657,35 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # await query.edit_message_text(text=f"Selected option: {query.data}")
 
 
+async def trending_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Switches the Add Hashtags keyboard between all time and trending."""
+    query = update.callback_query
+    await query.answer()
+    window = query.data[len("trend_") :]
+    if window not in HASHTAG_WINDOWS:
+        return
+    await query.edit_message_reply_markup(reply_markup=top_hashtags_markup(window))
+
+
 async def my_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Parses the CallbackQuery and updates the message text."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
     # get user hashtags
-    user_hashtags = user_table.get(User.id == user.id)["hashtags"]
+    user_hashtags = repository.get_user(user.id)["hashtags"]
 
     # CallbackQueries need to be answered, even if no notification to the user is needed
     # Some clients may have trouble otherwise. See https://core.telegram.org/bots/api#callbackquery
     await query.answer()
     logger.info(query.data)
-    data = query.data[2:]
-    user_hashtags = set(user_table.get(User.id == user.id)["hashtags"])
+    data = hashtag_aliases.canonical(query.data[2:])
+    user_hashtags = stored_hashtags(repository.get_user(user.id))
 
     if data in user_hashtags:
         user_hashtags.remove(data)
-    else:
+    elif data:
         user_hashtags.add(data)
 
     user_hashtags = list(user_hashtags)
@@ -562,7 +696,8 @@ async def my_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    user_table.update({"hashtags": user_hashtags}, User.id == user.id)
+    repository.update_user(user.id, {"hashtags": user_hashtags})
+    refresh_subscription(repository, user.id)
 
     if len(user_hashtags) == 0:
         await query.edit_message_text(
@@ -577,8 +712,9 @@ async def my_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def search_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show search settings to user."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
-    user_data = user_table.get(User.id == user.id)
+    user_data = repository.get_user(user.id)
     current_mode = user_data.get("match_mode", "any")
 
     keyboard = [
@@ -600,6 +736,12 @@ async def search_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 callback_data="mode_advanced",
             )
         ],
+        [
+            InlineKeyboardButton(
+                f"{'✅ ' if current_mode == 'query' else ''}Boolean query (/query)",
+                callback_data="mode_query",
+            )
+        ],
         [
             InlineKeyboardButton(
                 "⚙️ Configure Hashtag Groups",
@@ -618,6 +760,10 @@ async def search_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if current_mode == "advanced":
         advanced_info = f"\n\n*Required (AND):* {' '.join(required_tags) if required_tags else 'None'}\n*Optional (OR):* {' '.join(optional_tags) if optional_tags else 'None'}"
 
+    query_info = ""
+    if current_mode == "query":
+        query_info = f"\n*Your query:* {user_data.get('query') or 'None'}"
+
     await update.message.reply_text(
         f"""🔍 *Search Settings*
 
@@ -633,6 +779,9 @@ Example: If you have #python and #django, you'll ONLY get messages with BOTH #py
 Example: Required: #python #django, Optional: #backend
 → Messages MUST have #python AND #django, AND at least one of (#backend){advanced_info}
 
+*Boolean query:* Any combination of AND, OR, NOT and parentheses, set with /query.
+Example: /query #python AND (#django OR #flask) AND NOT #senior{query_info}
+
 Choose your preference:""",
         reply_markup=reply_markup,
         parse_mode="Markdown",
@@ -641,12 +790,13 @@ Choose your preference:""",
 
 async def configure_groups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show interface to configure required and optional hashtag groups."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
     await query.answer()
 
-    user_data = user_table.get(User.id == user.id)
+    user_data = repository.get_user(user.id)
     all_hashtags = user_data.get("hashtags", [])
     required_tags = user_data.get("required_hashtags", [])
     optional_tags = user_data.get("optional_hashtags", [])
@@ -688,6 +838,7 @@ async def toggle_hashtag_group(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Toggle hashtag between required, optional, and not set."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
@@ -698,7 +849,7 @@ async def toggle_hashtag_group(
     current_state = parts[1]  # "req", "opt", or "none"
     hashtag = parts[2]
 
-    user_data = user_table.get(User.id == user.id)
+    user_data = repository.get_user(user.id)
     required_tags = set(user_data.get("required_hashtags", []))
     optional_tags = set(user_data.get("optional_hashtags", []))
 
@@ -714,16 +865,17 @@ async def toggle_hashtag_group(
         optional_tags.discard(hashtag)
 
     # Update database
-    user_table.update(
+    repository.update_user(
+        user.id,
         {
             "required_hashtags": list(required_tags),
             "optional_hashtags": list(optional_tags),
         },
-        User.id == user.id,
     )
+    refresh_subscription(repository, user.id)
 
     # Refresh the interface
-    user_data = user_table.get(User.id == user.id)
+    user_data = repository.get_user(user.id)
     all_hashtags = user_data.get("hashtags", [])
 
     # Create keyboard with updated states
@@ -763,6 +915,7 @@ async def search_settings_button(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle search settings button callback."""
+    repository = context.bot_data["repository"]
     user = update.effective_user
     query = update.callback_query
 
@@ -778,18 +931,28 @@ async def search_settings_button(
         return
 
     # Extract mode from callback data
-    mode = query.data.split("_")[1]  # "mode_any", "mode_all", or "mode_advanced"
+    mode = query.data.split("_")[1]  # "mode_any", "mode_all", "mode_advanced"...
+
+    if mode == "query" and not repository.get_user(user.id).get("query"):
+        await query.edit_message_text(
+            "Set your query first, for example:\n"
+            "/query #python AND (#django OR #flask) AND NOT #senior"
+        )
+        return
 
     # Update user's match mode
-    user_table.update({"match_mode": mode}, User.id == user.id)
+    repository.update_user(user.id, {"match_mode": mode})
+    refresh_subscription(repository, user.id)
 
-    user_data = user_table.get(User.id == user.id)
+    user_data = repository.get_user(user.id)
     required_tags = user_data.get("required_hashtags", [])
     optional_tags = user_data.get("optional_hashtags", [])
 
     advanced_info = ""
     if mode == "advanced":
         advanced_info = f"\n\n*Required (AND):* {' '.join(required_tags) if required_tags else 'None'}\n*Optional (OR):* {' '.join(optional_tags) if optional_tags else 'None'}"
+    elif mode == "query":
+        advanced_info = f"\n\n*Your query:* {user_data.get('query')}"
 
     keyboard = [
         [
@@ -810,6 +973,12 @@ async def search_settings_button(
                 callback_data="mode_advanced",
             )
         ],
+        [
+            InlineKeyboardButton(
+                f"{'✅ ' if mode == 'query' else ''}Boolean query (/query)",
+                callback_data="mode_query",
+            )
+        ],
         [
             InlineKeyboardButton(
                 "⚙️ Configure Hashtag Groups",
@@ -846,47 +1015,125 @@ Example: If you have #python and #django, you'll ONLY get messages with BOTH #py
     )
 
 
+async def query_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Set, show or clear the user's boolean hashtag query."""
+    repository = context.bot_data["repository"]
+    user = update.effective_user
+    text = " ".join(context.args)
+
+    if not text:
+        current = repository.get_user(user.id).get("query")
+        await update.message.reply_text(
+            f"Your query: {current}\n\nChange it with /query <query>, "
+            "remove it with /query off"
+            if current
+            else "Usage: /query #python AND (#django OR #flask) AND NOT #senior"
+        )
+        return
+
+    if text.lower() == "off":
+        repository.update_user(user.id, {"query": None, "match_mode": "any"})
+        refresh_subscription(repository, user.id)
+        await update.message.reply_text("Query removed, matching ANY hashtag again.")
+        return
+
+    try:
+        compiled = compile_query(text)
+    except QuerySyntaxError as e:
+        await update.message.reply_text(f"Invalid query: {e}")
+        return
+
+    query_text = format_query(compiled.ast)
+    repository.update_user(user.id, {"query": query_text, "match_mode": "query"})
+    refresh_subscription(repository, user.id)
+    await update.message.reply_text(f"✅ Query saved: {query_text}")
+
+
+async def alias_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show or edit the hashtag alias table (admins only)."""
+    repository = context.bot_data["repository"]
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("Only admins can edit hashtag aliases.")
+        return
+
+    args = context.args
+    if len(args) == 2:
+        hashtag_aliases.set_alias(args[0], args[1])
+    elif len(args) == 1:
+        hashtag_aliases.remove_alias(args[0])
+    elif args:
+        await update.message.reply_text(
+            "Usage: /alias #alias #hashtag to add, /alias #alias to remove"
+        )
+        return
+
+    if args:
+        # Re-key the indexes with the new aliases
+        subscription_index.build(repository.all_users(), repository.version("users"))
+        post_index.sync(repository)
+
+    aliases = hashtag_aliases.aliases
+    lines = [f"{alias} → {target}" for alias, target in sorted(aliases.items())]
+    await update.message.reply_text(
+        "Hashtag aliases:\n" + "\n".join(lines) if lines else "No hashtag aliases."
+    )
+
+
+async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Turn logging of every message the listener sees on or off (admins only)."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("Only admins can change debug logging.")
+        return
+
+    # Only switchable when the listener runs in this process (main.run_both)
+    scraping = sys.modules.get("bot.scraping")
+    if scraping is None:
+        await update.message.reply_text("The listener is not running here.")
+        return
+
+    if context.args and context.args[0].lower() in ("on", "off"):
+        scraping.set_debug_messages(context.args[0].lower() == "on")
+    elif context.args:
+        await update.message.reply_text("Usage: /debug [on|off]")
+        return
+    state = "on" if scraping.debug_messages_enabled() else "off"
+    await update.message.reply_text(f"Debug message logging is {state}.")
+
+
 async def send_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message according to all users hashtags."""
+    repository = context.bot_data["repository"]
 
     # get users ids and hashtags
-    users = user_table.all()
+    users = repository.all_users()
+    post_index.sync(repository)
 
+    futures = []
     for user in users:
         user_hashtags = user["hashtags"]
-        search = data.search(Data.hashtags.all(user_hashtags))
+        search = post_index.documents(repository, post_index.all_of(user_hashtags))
         if len(search) == 0:
             continue
         for dct in search:
-            from core.getting_data import (
-                clean_markdown_for_telegram,
-                remove_all_markdown,
+            futures.append(
+                await scheduler.enqueue(context.bot, user["id"], render_cache.get(dct))
             )
 
-            text = to_text(dct)
-            cleaned_text = clean_markdown_for_telegram(str(text))
-            try:
-                try:
-                    await context.bot.send_message(
-                        user["id"],
-                        text=cleaned_text,
-                        parse_mode="Markdown",
-                    )
-                except Exception as parse_error:
-                    # If markdown parsing fails, send as plain text
-                    plain_text = remove_all_markdown(str(text))
-                    await context.bot.send_message(user["id"], text=plain_text)
-                    logger.info(
-                        f"Sent plain text message to user {user['id']} due to markdown error"
-                    )
-            except Exception as e:
-                logger.error(f"error {e}")
+    results = await asyncio.gather(*futures)
+    logger.info(f"Sent {sum(results)}/{len(results)} messages")
 
 
-def handler(application):
+def handler(application, repository=None):
+    # every handler reads and writes through the shared repository
+    application.bot_data["repository"] = repository or get_repository()
+
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("send", send_data))
+    application.add_handler(CommandHandler("alias", alias_command))
+    application.add_handler(CommandHandler("debug", debug_command))
+    application.add_handler(CommandHandler("query", query_command))
     application.add_handler(
         CallbackQueryHandler(search_settings_button, pattern=r"^mode_")
     )
@@ -900,10 +1147,18 @@ def handler(application):
         CallbackQueryHandler(toggle_hashtag_group, pattern=r"^toggle_")
     )
     application.add_handler(CallbackQueryHandler(perform_search, pattern=r"^search_"))
-    application.add_handler(CallbackQueryHandler(stop_search, pattern=r"^stop_search$"))
+    application.add_handler(CallbackQueryHandler(search_page, pattern=r"^page_\d+$"))
+    application.add_handler(
+        CallbackQueryHandler(search_range_button, pattern=r"^range_")
+    )
+    application.add_handler(CallbackQueryHandler(text_search, pattern=r"^textsearch$"))
+    application.add_handler(
+        CallbackQueryHandler(text_search_page, pattern=r"^textpage_\d+$")
+    )
     application.add_handler(CallbackQueryHandler(remove_button, pattern=r"^remove"))
     application.add_handler(CallbackQueryHandler(my_button, pattern=r"^my"))
     application.add_handler(CallbackQueryHandler(button, pattern=r"^#"))
+    application.add_handler(CallbackQueryHandler(trending_button, pattern=r"^trend_"))
     application.add_handler(CommandHandler("help", help_command))
 
     # on non command i.e message - echo the message on Telegram
@@ -921,6 +1176,9 @@ def handler(application):
         MessageHandler(filters.Text("⚙️ Search Settings"), search_settings)
     )
     application.add_handler(MessageHandler(filters.Regex(r"^#"), add_hashtag))
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, text_search_input)
+    )
 
     return application
 
@@ -1,17 +1,35 @@
 from pprint import pprint
-from telethon import TelegramClient, events
-from tinydb import TinyDB, Query
+from telethon import TelegramClient, events, utils
+import asyncio
 import datetime
-import json
 import sys
 import os
 from pathlib import Path
+from collections import Counter
 from dotenv import load_dotenv
 
 # Add parent directory to path to import main module
 sys.path.append(str(Path(__file__).parent.parent))
 
-from core.getting_data import to_json
+from core.backfill import (
+    RANGES,
+    FloodBudget,
+    fetch_batches,
+    partition,
+    range_checkpoint,
+    ranges_checkpoint,
+)
+from core.batch_writer import PostBatchWriter
+from core.channels import channel_message_id, channels
+from core.hashtag_stats import hashtag_stats
+from core.hashtags import hashtag_aliases
+from core.pipeline import Pipeline, Stage
+from core.post_index import post_index
+from core.post_parser import PostParseError, is_hashtag_line
+from core.repository import get_repository
+from core.stats_refresh import MAX_INTERVAL, refresh_views
+from core.text_index import text_index
+from core.trending import trending
 
 load_dotenv()
 
@@ -20,33 +38,27 @@ API_HASH = os.getenv("API_HASH")
 TOKEN = os.getenv("BOT_TOKEN")
 
 music_bot = "@music_storage1718_bot"
-ustoz_shogird = "https://t.me/UstozShogird"
-# ustoz_shogird = "@sanjarbek1718"
 
 client: TelegramClient = TelegramClient("anon", API_ID, API_HASH)
 bot: TelegramClient = TelegramClient("anon2", API_ID, API_HASH).start(bot_token=TOKEN)
 
-db = TinyDB("data_json/data.json", indent=4, separators=(",", ": "), encoding="utf-8")
-hashdb = TinyDB(
-    "data_json/hashtag.json", sort_keys=True, indent=4, separators=(",", ": ")
-)
-statsdb = TinyDB(
-    "data_json/statistics.json", sort_keys=True, indent=4, separators=(",", ": ")
-)
-
-datadb = db.table("data")
-stats_table = statsdb.table("stats")
+REFRESH_CHECK_INTERVAL = datetime.timedelta(hours=1)
+# Posts waiting in each stage of the ingest pipeline, and parallel senders
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 100))
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", 4))
+# Fetched batches waiting for the writer during a parallel backfill
+RANGE_QUEUE_SIZE = 16
+# Log every message the account sees, can be switched at runtime with /debug
+DEBUG_ALL_MESSAGES = os.getenv("DEBUG_ALL_MESSAGES", "").lower() in ("1", "true", "on")
 
-Hashtag = Query()
-hashtag = hashdb.table("hashtag")
-Stats = Query()
-Stats = Query()
+# Shared with the bot and the sender when running under main.run_both
+repository = get_repository()
 
 
-def save_message_stats(message):
+def save_message_stats(message, channel):
     """Save message statistics to database"""
     stats_data = {
-        "message_id": message.id,
+        "message_id": channel.post_key(message.id),
         "date": message.date.isoformat() if message.date else None,
         "text_length": len(message.text) if message.text else 0,
         "has_media": message.media is not None,
@@ -54,47 +66,201 @@ def save_message_stats(message):
         "forwards": getattr(message, "forwards", 0),
         "processed_at": datetime.datetime.now().isoformat(),
     }
-    stats_table.insert(stats_data)
+    repository.insert_stats(stats_data)
 
 
-def process_message(message):
-    """Process a single message and save to database"""
+def message_to_post(message, channel):
+    """Parse a message into a post document, raises PostParseError"""
+    dct = channel.parse(message.text)
+    # Add comprehensive message metadata directly
+    dct["message_id"] = channel.post_key(message.id)
+    dct["channel"] = channel.name
+    dct["date"] = message.date.isoformat() if message.date else None
+    dct["views"] = getattr(message, "views", 0)
+    dct["forwards"] = getattr(message, "forwards", 0)
+    # Handle MessageReplies object properly
+    replies = getattr(message, "replies", None)
+    dct["replies"] = replies.replies if replies else None
+    dct["edit_date"] = message.edit_date.isoformat() if message.edit_date else None
+    dct["media_type"] = type(message.media).__name__ if message.media else None
+    dct["text_length"] = len(message.text)
+    dct["processed_at"] = datetime.datetime.now().isoformat()
+    return dct
+
+
+def channel_of(message):
+    return channels.for_peer(message.chat_id) or channels.channels[0]
+
+
+def persist_message(message, channel=None):
+    """
+    Parse a message and save it with its statistics. Returns the post when it
+    is new, None when it was skipped or updated an already stored post.
+    """
     if not message.text:
-        return False
+        return None
+    channel = channel or channel_of(message)
 
     # Save statistics
-    save_message_stats(message)
+    save_message_stats(message, channel)
 
     # Process message content
-    lst = message.text.split("\n\n")
-    if len(lst) < 4:
-        print(f"Skipping message {message.id}: insufficient parts")
-        return False
+    try:
+        dct = message_to_post(message, channel)
+    except PostParseError as e:
+        print(f"Skipping message {message.id}: {e.reason}")
+        return None
 
     try:
-        dct = to_json(lst)
-        # Add comprehensive message metadata directly
-        dct["message_id"] = message.id
-        dct["date"] = message.date.isoformat() if message.date else None
-        dct["views"] = getattr(message, "views", 0)
-        dct["forwards"] = getattr(message, "forwards", 0)
-        # Handle MessageReplies object properly
-        replies = getattr(message, "replies", None)
-        dct["replies"] = replies.replies if replies else None
-        dct["edit_date"] = message.edit_date.isoformat() if message.edit_date else None
-        dct["media_type"] = type(message.media).__name__ if message.media else None
-        dct["text_length"] = len(message.text)
-        dct["processed_at"] = datetime.datetime.now().isoformat()
-        datadb.insert(dct)
-        print(f"Processed message {message.id}")
+        # Upserted by message_id: edits and repeated messages replace the post
+        previous = repository.get_post(dct["message_id"])
+        if previous is not None:
+            # A copy, the cached post is replaced in place by the upsert
+            previous = dict(previous)
+            dct = {**previous, **dct}
+        repository.insert_post(dct)
+    except Exception as e:
+        print(f"Error processing message {message.id}: {e}")
+        return None
+    if previous is not None:
+        reindex_post(previous, dct)
+        return None
+    return dct
+
+
+def index_post(dct):
+    """Add a saved post to the search indexes and trending counts"""
+    post_index.sync(repository)
+    post_index.add(dct["message_id"], dct["hashtags"], dct["date"])
+    post_index.save()
+    text_index.sync(repository)
+    text_index.add(dct["message_id"], dct)
+    text_index.save()
+    trending.add(dct["message_id"], dct["date"], dct["hashtags"])
+    count_hashtags([], dct["hashtags"])
+    print(f"Processed message {dct['message_id']}")
+    return dct
+
+
+def reindex_post(previous, dct):
+    """Move a replaced post from its old to its new words and hashtags"""
+    message_id = dct["message_id"]
+    post_index.sync(repository)
+    post_index.remove(message_id, previous.get("hashtags", []))
+    post_index.add(message_id, dct["hashtags"], dct["date"])
+    post_index.save()
+    text_index.sync(repository)
+    text_index.remove(message_id, previous)
+    text_index.add(message_id, dct)
+    text_index.save()
+    trending.remove(message_id, previous.get("hashtags"))
+    trending.add(message_id, dct["date"], dct["hashtags"])
+    count_hashtags(previous.get("hashtags", []), dct["hashtags"])
+    print(f"Updated message {message_id}")
+
+
+def purge_posts(message_ids):
+    """Delete stored posts and drop them from the indexes"""
+    posts = repository.get_posts(message_ids)
+    if not posts:
+        return
+    repository.delete_posts([post["message_id"] for post in posts])
+    post_index.sync(repository)
+    text_index.sync(repository)
+    for post in posts:
+        post_index.remove(post["message_id"], post.get("hashtags", []))
+        text_index.remove(post["message_id"], post)
+        trending.remove(post["message_id"], post.get("hashtags"))
+        count_hashtags(post.get("hashtags", []), [])
+    post_index.save()
+    text_index.save()
+    print(f"Deleted messages {[post['message_id'] for post in posts]}")
+
+
+def count_hashtags(old, new):
+    """Move the hashtag counts of a post from its old to its new hashtags"""
+    old = set(hashtag_aliases.canonical_all(old))
+    new = set(hashtag_aliases.canonical_all(new))
+    for tag in old - new:
+        hashtag_stats.increment(tag, -1)
+    for tag in new - old:
+        hashtag_stats.increment(tag)
+
+
+def process_message(message):
+    """Process a single message and save to database"""
+    dct = persist_message(message)
+    if dct is None:
+        return False
+    try:
+        index_post(dct)
         return True
     except Exception as e:
         print(f"Error processing message {message.id}: {e}")
         return False
 
 
-# Add a general message listener for debugging
-@client.on(events.NewMessage())
+class Deletion:
+    """Deleted post keys, queued behind the messages that came before them"""
+
+    def __init__(self, keys):
+        self.keys = keys
+
+
+def ingest_message(item):
+    """Parse/persist stage: save the post, or purge deleted ones"""
+    if isinstance(item, Deletion):
+        purge_posts(item.keys)
+        return None
+    return persist_message(item, channel_of(item))
+
+
+def deleted(dct):
+    """Whether a post was deleted while it waited in a later stage"""
+    return repository.get_post(dct["message_id"]) is None
+
+
+def index_new_post(dct):
+    """Index stage: add the post unless it was deleted in the meantime"""
+    if deleted(dct):
+        return None
+    return index_post(dct)
+
+
+async def deliver_post(dct):
+    """Delivery stage: send the post to the subscribed users"""
+    import main
+
+    if deleted(dct):
+        return
+    await main.send_new_message(dct, repository)
+
+
+# New posts go raw -> parse/persist -> index -> delivery, see core.pipeline.
+# Deletions take the parse stage too, so they follow the posts they delete.
+ingest = Pipeline(
+    [
+        Stage("parse", ingest_message, queue_size=INGEST_QUEUE_SIZE),
+        Stage("index", index_new_post, queue_size=INGEST_QUEUE_SIZE),
+        Stage(
+            "delivery",
+            deliver_post,
+            concurrency=DELIVERY_CONCURRENCY,
+            queue_size=INGEST_QUEUE_SIZE,
+        ),
+    ]
+)
+
+
+async def resolve_channels():
+    """Resolve the registered channels once into the peer id -> channel map"""
+    for channel in channels:
+        entity = await client.get_entity(channel.url)
+        # event.chat_id is the marked peer id (-100...), not entity.id
+        channels.resolved(utils.get_peer_id(entity), channel)
+    return channels.by_peer
+
+
 async def debug_all_messages(event):
     """Debug handler to catch ALL messages"""
     chat_info = getattr(
@@ -103,15 +269,28 @@ async def debug_all_messages(event):
     print(f"📨 [DEBUG] Message from: {chat_info} (ID: {event.chat_id})")
 
     # Check if this is our target channel
-    target_entity = await client.get_entity(ustoz_shogird)
-    if event.chat_id == target_entity.id:
+    if event.chat_id in channels.by_peer:
         print(f"🎯 TARGET CHANNEL DETECTED! This should trigger specific handler too!")
 
 
-@client.on(events.NewMessage(chats=ustoz_shogird))
+def debug_messages_enabled():
+    return any(
+        callback is debug_all_messages for callback, _ in client.list_event_handlers()
+    )
+
+
+def set_debug_messages(enabled):
+    """Turn the catch-all debug handler on or off while the client runs"""
+    if enabled and not debug_messages_enabled():
+        client.add_event_handler(debug_all_messages, events.NewMessage())
+    elif not enabled:
+        client.remove_event_handler(debug_all_messages)
+    print(f"Debug message logging {'on' if enabled else 'off'}")
+
+
 async def new_message_handler(event):
-    """Handle new messages from the channel in real-time"""
-    print(f"🎯 NEW MESSAGE FROM USTOZ-SHOGIRD!")
+    """Handle new messages from the registered channels in real-time"""
+    print(f"🎯 NEW MESSAGE FROM {channels.for_peer(event.chat_id).name}!")
     print(f"   Message ID: {event.message.id}")
     print(f"   Date: {event.message.date}")
     print(
@@ -119,370 +298,239 @@ async def new_message_handler(event):
     )
     print(f"New message received: {event.message.id}")
 
-    # Process message and get the processed data
-    message_processed = process_message(event.message)
+    # Parsing, indexing and sending happen in the ingest pipeline stages
+    await ingest.submit(event.message)
 
-    if message_processed:
-        # Get the processed message data from database
-        processed_data = datadb.get(Query().message_id == event.message.id)
-        if processed_data:
-            # Import and call the send function from main.py
-            try:
-                import main
 
-                await main.send_new_message(processed_data)
-                print(f"Sent new message {event.message.id} to subscribed users")
-            except Exception as e:
-                print(f"Error sending message to users: {e}")
+async def message_edited_handler(event):
+    """Update an edited post, in order with the new messages"""
+    print(f"Message edited: {event.message.id}")
+    await ingest.submit(event.message)
 
-    # Also update hashtags if the message contains hashtags
-    if event.message.text:
-        await update_hashtags_from_message(event.message)
 
-
-async def update_hashtags_from_message(message):
-    """Update hashtag statistics from a single message"""
-    if not message.text:
+async def message_deleted_handler(event):
+    """Purge deleted posts of the registered channels, in order with new ones"""
+    channel = channels.for_peer(event.chat_id) if event.chat_id else None
+    # Deletions outside channels don't say which chat they happened in
+    if channel is None:
         return
-
-    lines = message.text.split("\n")
-    for line in lines:
-        if line.startswith("#"):
-            hashtags = line.split(" ")
-            for h in hashtags:
-                if len(h) == 0 or h.isspace():
-                    continue
-                if not hashtag.get(Hashtag.hashtag == h):
-                    hashtag.insert({"hashtag": h, "count": 1})
-                else:
-                    dct = hashtag.get(Hashtag.hashtag == h)
-                    hashtag.update({"count": dct["count"] + 1}, Hashtag.hashtag == h)
+    keys = [channel.post_key(message_id) for message_id in event.deleted_ids]
+    await ingest.submit(Deletion(keys))
 
 
-async def start_listening():
+async def start_listening(shared_repository=None):
     """Start listening for new messages"""
-    print(f"Starting to listen for new messages from {ustoz_shogird}...")
+    global repository
+    if shared_repository is not None:
+        repository = shared_repository
+    print(f"Starting to listen for new messages from {', '.join(channels.urls())}...")
     await client.start()
-    await client.run_until_disconnected()
-
-
-async def scrape_all():
-    """
-    Scrape all messages from the channel in reverse order, saving progress to allow resuming.
-    Progress is tracked by last processed message ID in a file.
-    """
+    await resolve_channels()
+    # One subscription for every registered channel, by resolved peer id
+    peers = list(channels.by_peer)
+    client.add_event_handler(new_message_handler, events.NewMessage(chats=peers))
+    client.add_event_handler(message_edited_handler, events.MessageEdited(chats=peers))
+    client.add_event_handler(
+        message_deleted_handler, events.MessageDeleted(chats=peers)
+    )
+    if DEBUG_ALL_MESSAGES:
+        set_debug_messages(True)
+    flusher = asyncio.create_task(hashtag_stats.run())
+    ingest.start()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        await ingest.stop()
+        flusher.cancel()
 
-    progress_file = "data_json/scrape_progress.json"
-    last_id = None
-    # Load last processed message id if exists
-    if os.path.exists(progress_file):
-        with open(progress_file, "r") as f:
-            try:
-                last_id = json.load(f).get("last_id")
-            except Exception:
-                last_id = None
 
-    # Only truncate if starting from scratch
-    if last_id is None:
-        datadb.truncate()
-
-    total = 0
-    async for message in client.iter_messages(
-        ustoz_shogird, reverse=True, min_id=last_id or 0
-    ):
-        if not message.text:
-            continue
-        lst = message.text.split("\n\n")
-        if len(lst) < 4:
-            print(lst)
-            continue
-        try:
-            dct = to_json(lst)
-            # Add comprehensive message metadata directly
-            dct["message_id"] = message.id
-            dct["date"] = message.date.isoformat() if message.date else None
-            dct["views"] = getattr(message, "views", 0)
-            dct["forwards"] = getattr(message, "forwards", 0)
-            # Handle MessageReplies object properly
-            replies = getattr(message, "replies", None)
-            dct["replies"] = replies.replies if replies else None
-            dct["edit_date"] = (
-                message.edit_date.isoformat() if message.edit_date else None
-            )
-            dct["media_type"] = type(message.media).__name__ if message.media else None
-            dct["text_length"] = len(message.text)
-            dct["processed_at"] = datetime.datetime.now().isoformat()
-            datadb.insert(dct)
-            last_id = message.id
-            total += 1
-            print(f"Scraped message {message.id} from {message.date}")
-        except Exception as e:
-            print(f"Error processing message {message.id}: {e}")
-            continue
-        # Save progress every 20 messages
-        if total % 20 == 0:
-            with open(progress_file, "w") as f:
-                json.dump({"last_id": last_id}, f)
-    # Save final progress
-    if last_id is not None:
-        with open(progress_file, "w") as f:
-            json.dump({"last_id": last_id}, f)
+def backfill_started(channel):
+    return (
+        repository.get_checkpoint(channel.checkpoint) is not None
+        or repository.get_checkpoint(ranges_checkpoint(channel.checkpoint)) is not None
+    )
 
 
-async def scrape_periodic(interval_days=30):
+async def backfill(ranges=None):
     """
-    Periodically re-scrape all messages to update views/forwards data.
-    Default interval is 30 days (monthly).
+    Scrape every registered channel concurrently, each from its own checkpoint.
+    History requests of all channels share one flood-wait budget. With ranges,
+    every channel is split into that many id ranges fetched in parallel.
     """
-    import asyncio
-
-    last_scrape_file = "data_json/last_scrape.json"
-
-    while True:
-        # Check if it's time for periodic scrape
-        should_scrape = False
-
-        if os.path.exists(last_scrape_file):
-            with open(last_scrape_file, "r") as f:
-                try:
-                    last_scrape = json.load(f).get("last_scrape")
-                    last_scrape_date = datetime.datetime.fromisoformat(last_scrape)
-                    days_since = (datetime.datetime.now() - last_scrape_date).days
-
-                    if days_since >= interval_days:
-                        should_scrape = True
-                        print(
-                            f"⏰ {days_since} days since last scrape. Starting periodic update..."
-                        )
-                except Exception:
-                    should_scrape = True
-                    print(
-                        "🚀 No valid last scrape found. Starting initial periodic scrape..."
-                    )
-        else:
-            should_scrape = True
-            print("🚀 Starting first periodic scrape...")
-
-        if should_scrape:
-            print(f"📊 Updating message statistics (views, forwards, etc.)...")
-            await scrape_all_for_updates()
-
-            # Save last scrape timestamp
-            with open(last_scrape_file, "w") as f:
-                json.dump(
-                    {
-                        "last_scrape": datetime.datetime.now().isoformat(),
-                        "interval_days": interval_days,
-                    },
-                    f,
-                )
-
-            print(f"✅ Periodic scrape completed. Next update in {interval_days} days.")
+    # Only truncate if starting from scratch
+    if not any(backfill_started(c) for c in channels):
+        repository.truncate_posts()
+        post_index.clear()
+        post_index.save()
+        text_index.clear()
+        text_index.save()
+    else:
+        post_index.sync(repository)
+        text_index.sync(repository)
 
-        # Wait for next check (check daily)
-        print(
-            f"💤 Sleeping for 24 hours. Next check: {datetime.datetime.now() + datetime.timedelta(days=1)}"
-        )
-        await asyncio.sleep(24 * 60 * 60)  # 24 hours
+    budget = FloodBudget()
+    if ranges:
+        scrapes = (scrape_ranges(channel, ranges, budget) for channel in channels)
+    else:
+        scrapes = (scrape_all(channel, budget) for channel in channels)
+    await asyncio.gather(*scrapes)
 
 
-async def scrape_all_for_updates():
+async def scrape_all(channel, budget=None):
     """
-    Re-scrape all messages to update changing data like views and forwards.
-    This doesn't add new records, just updates existing ones.
+    Scrape all messages from the channel in reverse order, saving progress to allow resuming.
+    Posts are written in batches, each batch together with the last message ID it contains.
     """
-    total = 0
-    updated = 0
-
-    async for message in client.iter_messages(ustoz_shogird):
-        if not message.text:
-            continue
-
-        # Check if message exists in database
-        existing = datadb.get(Query().message_id == message.id)
-        if existing:
-            # Update only the changing fields
-            current_views = getattr(message, "views", 0)
-            current_forwards = getattr(message, "forwards", 0)
-
-            old_views = existing.get("views", 0)
-            old_forwards = existing.get("forwards", 0)
-
-            # Only update if there's a change
-            if current_views != old_views or current_forwards != old_forwards:
-                datadb.update(
-                    {
-                        "views": current_views,
-                        "forwards": current_forwards,
-                        "last_updated": datetime.datetime.now().isoformat(),
-                    },
-                    Query().message_id == message.id,
-                )
-
-                # Also save to stats table for historical tracking
-                stats_data = {
-                    "message_id": message.id,
-                    "date": message.date.isoformat() if message.date else None,
-                    "text_length": len(message.text) if message.text else 0,
-                    "has_media": message.media is not None,
-                    "views": current_views,
-                    "forwards": current_forwards,
-                    "processed_at": datetime.datetime.now().isoformat(),
-                    "update_type": "periodic",
-                }
-                stats_table.insert(stats_data)
-
-                updated += 1
+    budget = budget or FloodBudget()
+    last_id = repository.get_checkpoint(channel.checkpoint)
+
+    writer = PostBatchWriter(repository, channel.checkpoint)
+    failures = Counter()
+    min_id = channel_message_id(last_id) if last_id else 0
+    async for batch in fetch_batches(client, channel.url, budget, min_id=min_id):
+        for message in batch:
+            if not message.text:
+                continue
+            # Stored by a batch whose checkpoint did not make it to disk
+            if repository.get_post(channel.post_key(message.id)) is not None:
+                continue
+            try:
+                writer.add(message_to_post(message, channel))
                 print(
-                    f"📈 Updated message {message.id}: views {old_views}→{current_views}, forwards {old_forwards}→{current_forwards}"
+                    f"Scraped {channel.name} message {message.id} from {message.date}"
                 )
-
-        total += 1
-        if total % 100 == 0:
-            print(f"🔄 Checked {total} messages, updated {updated} so far...")
-
-    print(f"✅ Completed update: {updated}/{total} messages had changes")
+            except PostParseError as e:
+                failures[e.reason] += 1
+                print(f"Skipping message {message.id}: {e.reason}")
+            except Exception as e:
+                print(f"Error processing message {message.id}: {e}")
+    # Save the last partial batch
+    writer.flush()
+    print(f"✅ Scraped {writer.total} messages from {channel.name}")
+    if failures:
+        summary = ", ".join(f"{reason}: {n}" for reason, n in failures.most_common())
+        print(f"⚠️ Skipped {sum(failures.values())} unparsable messages ({summary})")
 
 
-async def scrape_periodic(interval_days=30):
+async def scrape_ranges(channel, parts=RANGES, budget=None):
     """
-    Periodically re-scrape all messages to update views/forwards data.
-    Default interval is 30 days (monthly).
+    Backfill a channel with one fetcher per id range and a single writer.
+    Every range resumes from its own checkpoint after an interruption.
     """
-    import asyncio
-
-    last_scrape_file = "data_json/last_scrape.json"
+    budget = budget or FloodBudget()
+    plan_name = ranges_checkpoint(channel.checkpoint)
+    plan = repository.get_checkpoint(plan_name)
+    if plan is None:
+        last_id = repository.get_checkpoint(channel.checkpoint)
+        start = channel_message_id(last_id) if last_id else 0
+        latest = await budget.call(lambda: client.get_messages(channel.url, limit=1))
+        top = latest[0].id if latest else start
+        plan = partition(start, top, parts)
+        repository.set_checkpoint(plan_name, plan)
+    print(f"Backfilling {channel.name} in {len(plan)} ranges: {plan}")
+
+    batches = asyncio.Queue(RANGE_QUEUE_SIZE)
+
+    async def fetch(lo, hi):
+        name = range_checkpoint(channel.checkpoint, lo, hi)
+        done = repository.get_checkpoint(name)
+        min_id = channel_message_id(done) if done else lo
+        # max_id is exclusive, the range includes hi
+        async for batch in fetch_batches(
+            client, channel.url, budget, min_id=min_id, max_id=hi + 1
+        ):
+            await batches.put((name, batch))
+
+    async def fetch_all():
+        try:
+            await asyncio.gather(*(fetch(lo, hi) for lo, hi in plan))
+        finally:
+            await batches.put(None)
 
-    while True:
-        # Check if it's time for periodic scrape
-        should_scrape = False
+    fetchers = asyncio.create_task(fetch_all())
 
-        if os.path.exists(last_scrape_file):
-            with open(last_scrape_file, "r") as f:
+    # The only writer: posts of every range are committed in shared batches
+    writer = PostBatchWriter(repository, channel.checkpoint)
+    failures = Counter()
+    try:
+        while (item := await batches.get()) is not None:
+            name, batch = item
+            for message in batch:
+                if not message.text:
+                    continue
+                if repository.get_post(channel.post_key(message.id)) is not None:
+                    continue
                 try:
-                    last_scrape = json.load(f).get("last_scrape")
-                    last_scrape_date = datetime.datetime.fromisoformat(last_scrape)
-                    days_since = (datetime.datetime.now() - last_scrape_date).days
-
-                    if days_since >= interval_days:
-                        should_scrape = True
-                        print(
-                            f"⏰ {days_since} days since last scrape. Starting periodic update..."
-                        )
-                except Exception:
-                    should_scrape = True
-                    print(
-                        "🚀 No valid last scrape found. Starting initial periodic scrape..."
-                    )
-        else:
-            should_scrape = True
-            print("🚀 Starting first periodic scrape...")
-
-        if should_scrape:
-            print("📊 Updating message statistics (views, forwards, etc.)...")
-            await scrape_all_for_updates()
-
-            # Save last scrape timestamp
-            with open(last_scrape_file, "w") as f:
-                json.dump(
-                    {
-                        "last_scrape": datetime.datetime.now().isoformat(),
-                        "interval_days": interval_days,
-                    },
-                    f,
-                )
+                    writer.add(message_to_post(message, channel), name)
+                except PostParseError as e:
+                    failures[e.reason] += 1
+                except Exception as e:
+                    print(f"Error processing message {message.id}: {e}")
+            writer.advance(name, channel.post_key(batch[-1].id))
+            print(f"Scraped {channel.name} messages {batch[0].id}-{batch[-1].id}")
+    finally:
+        writer.flush()
+        if not fetchers.done():
+            fetchers.cancel()
+    # Raises if a fetcher failed; the finished ranges keep their checkpoints
+    await fetchers
+
+    # Done: later runs continue after the top of the plan
+    if plan:
+        repository.set_checkpoint(channel.checkpoint, channel.post_key(plan[-1][1]))
+    repository.set_checkpoint(plan_name, None)
+    print(f"✅ Scraped {writer.total} messages from {channel.name}")
+    if failures:
+        summary = ", ".join(f"{reason}: {n}" for reason, n in failures.most_common())
+        print(f"⚠️ Skipped {sum(failures.values())} unparsable messages ({summary})")
 
-            print(f"✅ Periodic scrape completed. Next update in {interval_days} days.")
 
-        # Wait for next check (check daily)
+async def scrape_periodic(interval_days=30):
+    """
+    Keep views/forwards data fresh with incremental refreshes.
+    Every hour only the posts that are due are refreshed; interval_days is the
+    longest a post goes without a refresh (old posts).
+    """
+    max_interval = datetime.timedelta(days=interval_days)
+    while True:
+        print("📊 Updating message statistics (views, forwards, etc.)...")
+        await scrape_all_for_updates(max_interval)
         print(
-            f"💤 Sleeping for 24 hours. Next check: {datetime.datetime.now() + datetime.timedelta(days=1)}"
+            f"💤 Sleeping for 1 hour. Next check: {datetime.datetime.now() + REFRESH_CHECK_INTERVAL}"
         )
-        await asyncio.sleep(24 * 60 * 60)  # 24 hours
+        await asyncio.sleep(REFRESH_CHECK_INTERVAL.total_seconds())
 
 
-async def scrape_all_for_updates():
+async def scrape_all_for_updates(max_interval=MAX_INTERVAL):
     """
-    Re-scrape all messages to update changing data like views and forwards.
+    Update changing data like views and forwards of the posts that are due.
     This doesn't add new records, just updates existing ones.
     """
-    total = 0
-    updated = 0
-
-    async for message in client.iter_messages(ustoz_shogird):
-        if not message.text:
-            continue
-
-        # Check if message exists in database
-        existing = datadb.get(Query().message_id == message.id)
-        if existing:
-            # Update only the changing fields
-            current_views = getattr(message, "views", 0)
-            current_forwards = getattr(message, "forwards", 0)
-
-            old_views = existing.get("views", 0)
-            old_forwards = existing.get("forwards", 0)
-
-            # Only update if there's a change
-            if current_views != old_views or current_forwards != old_forwards:
-                datadb.update(
-                    {
-                        "views": current_views,
-                        "forwards": current_forwards,
-                        "last_updated": datetime.datetime.now().isoformat(),
-                    },
-                    Query().message_id == message.id,
-                )
-
-                # Also save to stats table for historical tracking
-                stats_data = {
-                    "message_id": message.id,
-                    "date": message.date.isoformat() if message.date else None,
-                    "text_length": len(message.text) if message.text else 0,
-                    "has_media": message.media is not None,
-                    "views": current_views,
-                    "forwards": current_forwards,
-                    "processed_at": datetime.datetime.now().isoformat(),
-                    "update_type": "periodic",
-                }
-                stats_table.insert(stats_data)
-
-                updated += 1
-                print(
-                    f"📈 Updated message {message.id}: views {old_views}→{current_views}, forwards {old_forwards}→{current_forwards}"
-                )
-
-        total += 1
-        if total % 100 == 0:
-            print(f"🔄 Checked {total} messages, updated {updated} so far...")
-
-    print(f"✅ Completed update: {updated}/{total} messages had changes")
+    changed = 0
+    for channel in channels:
+        changed += await refresh_views(client, channel, repository, max_interval)
+    return changed
 
 
 async def get_hashtags():
-    async for message in client.iter_messages(ustoz_shogird, limit=500):
-        lst = message.text.split("\n")
-
-        for line in lst:
-            if line.startswith("#"):
-                hashtags = line.split(" ")
-                for h in hashtags:
-                    # check if hashtag exists
-                    if len(h) == 0 or h.isspace():
-                        continue
-                    if not hashtag.get(Hashtag.hashtag == h):
-                        hashtag.insert({"hashtag": h, "count": 1})
-                    else:
-                        dct = hashtag.get(Hashtag.hashtag == h)
-                        # update count
-                        hashtag.update(
-                            {"count": dct["count"] + 1}, Hashtag.hashtag == h
-                        )
-
-
-def run_scrape_all():
+    for channel in channels:
+        async for message in client.iter_messages(channel.url, limit=500):
+            lst = (message.text or "").split("\n")
+
+            for line in lst:
+                if line.startswith("#") and is_hashtag_line(line):
+                    hashtags = line.split(" ")
+                    for h in hashtags:
+                        # check if hashtag exists
+                        tag = hashtag_aliases.canonical(h)
+                        if tag:
+                            hashtag_stats.increment(tag)
+    hashtag_stats.flush()
+
+
+def run_scrape_all(ranges=None):
     with client:
-        client.loop.run_until_complete(scrape_all())
+        client.loop.run_until_complete(backfill(ranges))
 
 
 def run_hashtags():
@@ -498,14 +546,7 @@ def run_listener():
 
 def run_periodic(days=30):
     """Run periodic scraper with specified interval"""
-    print(f"Starting periodic scraper (every {days} days)...")
-    with client:
-        client.loop.run_until_complete(scrape_periodic(days))
-
-
-def run_periodic(days=30):
-    """Run periodic scraper with specified interval"""
-    print(f"Starting periodic scraper (every {days} days)...")
+    print(f"Starting periodic scraper (old posts every {days} days)...")
     with client:
         client.loop.run_until_complete(scrape_periodic(days))
 
@@ -518,8 +559,10 @@ if __name__ == "__main__":
             print("Starting listener mode...")
             run_listener()
         elif sys.argv[1] == "scrape":
+            # An optional number of id ranges to fetch in parallel
+            ranges = int(sys.argv[2]) if len(sys.argv) > 2 else None
             print("Starting scrape mode...")
-            run_scrape_all()
+            run_scrape_all(ranges)
         elif sys.argv[1] == "hashtags":
             print("Starting hashtag collection...")
             run_hashtags()
@@ -529,16 +572,21 @@ if __name__ == "__main__":
             print(f"Starting periodic mode (every {days} days)...")
             run_periodic(days)
         else:
-            print("Usage: python scraping.py [listen|scrape|hashtags|periodic [days]]")
+            print(
+                "Usage: python scraping.py [listen|scrape [ranges]|hashtags|periodic [days]]"
+            )
             print("Examples:")
             print("  python scraping.py periodic       # Monthly updates (30 days)")
             print("  python scraping.py periodic 7     # Weekly updates")
             print("  python scraping.py periodic 1     # Daily updates")
     else:
-        print("Usage: python scraping.py [listen|scrape|hashtags|periodic [days]]")
+        print(
+            "Usage: python scraping.py [listen|scrape [ranges]|hashtags|periodic [days]]"
+        )
         print("Examples:")
         print("  python scraping.py listen         # Real-time listener mode")
         print("  python scraping.py scrape         # Scrape all messages")
+        print("  python scraping.py scrape 8       # Scrape in 8 parallel id ranges")
         print("  python scraping.py hashtags       # Collect hashtags")
         print("  python scraping.py periodic       # Monthly updates (30 days)")
         print("  python scraping.py periodic 7     # Weekly updates")
@@ -0,0 +1,83 @@
+"""
+Paced fetching of channel history for backfills.
+
+Several channels (or id ranges) are fetched at the same time but share one
+FloodBudget: at most `concurrency` history requests are in flight, and a
+FloodWaitError on any of them pauses every worker until Telegram allows
+requests again, instead of each worker running into the limit on its own.
+
+A large channel can also be split into id ranges fetched side by side. The
+plan of ranges is saved as a checkpoint and every range keeps its own
+checkpoint, so an interrupted backfill resumes each range where it stopped.
+"""
+
+import asyncio
+import time
+
+from telethon.errors import FloodWaitError
+
+REQUEST_CONCURRENCY = 3
+BATCH_SIZE = 100  # messages per GetHistory request
+RANGES = 4
+
+
+def partition(start, top, parts=RANGES):
+    """Split the ids start < id <= top into up to parts (lo, hi] ranges."""
+    bounds = sorted({start + (top - start) * i // parts for i in range(parts + 1)})
+    return [[lo, hi] for lo, hi in zip(bounds, bounds[1:])]
+
+
+def ranges_checkpoint(checkpoint):
+    """Name of the checkpoint holding the range plan of a channel."""
+    return f"{checkpoint}:ranges"
+
+
+def range_checkpoint(checkpoint, lo, hi):
+    """Name of the checkpoint of one (lo, hi] range."""
+    return f"{checkpoint}:{lo}-{hi}"
+
+
+class FloodBudget:
+    """Request slots and a shared pause after a flood wait."""
+
+    def __init__(self, concurrency=REQUEST_CONCURRENCY):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.resume_at = 0
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    async def call(self, request):
+        """Await request() in a free slot, retrying after flood waits."""
+        while True:
+            delay = self.resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self.semaphore:
+                if self.resume_at > time.monotonic():
+                    continue
+                try:
+                    return await request()
+                except FloodWaitError as e:
+                    print(f"⏳ Flood wait of {e.seconds}s, pausing every worker")
+                    self.pause(e.seconds)
+
+
+async def fetch_batches(
+    client, entity, budget, min_id=0, max_id=0, batch_size=BATCH_SIZE
+):
+    """Yield the messages after min_id (and before max_id) oldest first."""
+    while True:
+        batch = await budget.call(
+            lambda: client.get_messages(
+                entity,
+                limit=batch_size,
+                min_id=min_id,
+                max_id=max_id,
+                reverse=True,
+            )
+        )
+        if not batch:
+            return
+        yield batch
+        min_id = batch[-1].id
@@ -0,0 +1,76 @@
+"""
+Buffered writer for backfilling posts.
+
+Parsed posts are collected in memory and committed with one bulk insert
+every batch_size posts or flush_interval seconds, together with the scrape
+checkpoint of the last post in the batch. Posts of several id ranges can go
+through one writer, each with its own checkpoint name.
+"""
+
+import time
+
+from core.post_index import post_index
+from core.text_index import text_index
+from core.trending import trending
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 10  # seconds
+
+
+class PostBatchWriter:
+    """Buffers posts and commits them in batches with their checkpoint."""
+
+    def __init__(
+        self,
+        repository,
+        checkpoint_name="last_id",
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        self.repository = repository
+        self.checkpoint_name = checkpoint_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_id = None
+        # checkpoint name -> value, written with the next batch
+        self.checkpoints = {}
+        self.last_flush = time.monotonic()
+        self.total = 0
+
+    def add(self, post, checkpoint_name=None):
+        self.buffer.append(post)
+        self.last_id = post["message_id"]
+        self.checkpoints[checkpoint_name or self.checkpoint_name] = self.last_id
+        if (
+            len(self.buffer) >= self.batch_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def advance(self, checkpoint_name, value):
+        """Move a checkpoint past messages that produced no post."""
+        self.checkpoints[checkpoint_name] = value
+
+    def flush(self):
+        """Commit the buffered posts, their checkpoint and the indexes."""
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            # Messages without posts (no text, unparsable) still move a range on
+            for name, value in self.checkpoints.items():
+                self.repository.set_checkpoint(name, value)
+            self.checkpoints = {}
+            return
+        self.repository.insert_posts(self.buffer, self.checkpoints)
+        self.checkpoints = {}
+        for post in self.buffer:
+            post_index.add(
+                post["message_id"], post.get("hashtags", []), post.get("date")
+            )
+            text_index.add(post["message_id"], post)
+            trending.add(post["message_id"], post.get("date"), post.get("hashtags"))
+        post_index.save()
+        text_index.save()
+        self.total += len(self.buffer)
+        print(f"💾 Saved {len(self.buffer)} messages (up to {self.last_id})")
+        self.buffer = []
@@ -0,0 +1,96 @@
+"""
+Registry of the channels the listener and the scraper read.
+
+The registry is data_json/channels.json (CHANNELS_PATH), a list of
+
+    {"name": "ustoz_shogird", "url": "https://t.me/UstozShogird",
+     "slot": 0, "parser": "ustoz_shogird"}
+
+Without the file only UstozShogird is read. Telegram message ids are only
+unique within a channel, so a post is stored under the key
+slot << 32 | message id: the channel in slot 0 keeps its plain message ids
+and every other channel gets its own id range. A slot must never change
+once posts of the channel were stored.
+"""
+
+import json
+import os
+
+from core.post_parser import PARSERS
+
+CHANNELS_PATH = os.getenv("CHANNELS_PATH", "data_json/channels.json")
+SLOT_BITS = 32
+DEFAULT_CHANNELS = [
+    {
+        "name": "ustoz_shogird",
+        "url": "https://t.me/UstozShogird",
+        "slot": 0,
+        "parser": "ustoz_shogird",
+    }
+]
+
+
+class Channel:
+    """One source channel: its URL, id slot, parser and scrape checkpoint."""
+
+    def __init__(self, name, url, slot, parser="ustoz_shogird"):
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser!r} for channel {name!r}")
+        self.name = name
+        self.url = url
+        self.slot = slot
+        self.parse = PARSERS[parser]
+        # The first channel keeps the checkpoint name of the single-channel bot
+        self.checkpoint = "last_id" if slot == 0 else f"last_id:{name}"
+
+    @property
+    def username(self):
+        return self.url.rstrip("/").rsplit("/", 1)[-1].lstrip("@")
+
+    def post_key(self, message_id):
+        """The stored message_id of a message of this channel."""
+        return (self.slot << SLOT_BITS) | message_id
+
+    def link(self, message_id):
+        return f"https://t.me/{self.username}/{message_id}"
+
+
+def channel_message_id(key):
+    """The Telegram message id of a stored message_id."""
+    return key & ((1 << SLOT_BITS) - 1)
+
+
+class ChannelRegistry:
+    """The configured channels, by name, by id slot and by peer id."""
+
+    def __init__(self, path=CHANNELS_PATH):
+        self.path = path
+        entries = DEFAULT_CHANNELS
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        self.channels = [Channel(**entry) for entry in entries]
+        self.by_slot = {channel.slot: channel for channel in self.channels}
+        if len(self.by_slot) != len(self.channels):
+            raise ValueError(f"Channel slots in {path} must be unique")
+        # Marked peer id (-100...) -> Channel, filled once the client resolved them
+        self.by_peer = {}
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def urls(self):
+        return [channel.url for channel in self.channels]
+
+    def resolved(self, peer_id, channel):
+        self.by_peer[peer_id] = channel
+
+    def for_peer(self, peer_id):
+        return self.by_peer.get(peer_id)
+
+    def for_post(self, post):
+        """The channel a stored post came from."""
+        return self.by_slot.get(post["message_id"] >> SLOT_BITS, self.channels[0])
+
+
+channels = ChannelRegistry()
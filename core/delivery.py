@@ -0,0 +1,235 @@
+"""
+Rate-limit-aware delivery of bot messages.
+
+Every send goes through one process-wide DeliveryScheduler: a bounded pool
+of asyncio workers sharing a global token bucket (Telegram allows about 30
+messages per second) and a token bucket per chat (about 1 message per
+second). Messages to one chat keep their order, a RetryAfter only pauses
+the bucket of the chat that hit it.
+
+Messages are RenderedPost objects, already valid for their parse mode.
+"""
+
+import asyncio
+import datetime
+import time
+from collections import deque
+
+import telegram
+
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+WORKERS = 8
+MAX_PENDING = 10000
+MAX_ATTEMPTS = 5
+
+
+def is_transient(error):
+    """
+    Whether sending the same message again later may succeed: flood limits
+    and network trouble, but not a blocked bot (Forbidden) or a message
+    Telegram rejects (BadRequest, also a NetworkError subclass).
+    """
+    return isinstance(
+        error, (telegram.error.RetryAfter, telegram.error.NetworkError)
+    ) and not isinstance(error, telegram.error.BadRequest)
+
+
+class TokenBucket:
+    """Classic token bucket that can also be paused for a while."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self):
+        """Seconds until a token is available, 0 if one is available now."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    async def acquire(self):
+        while (delay := self.wait_time()) > 0:
+            await asyncio.sleep(delay)
+        self.consume()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self):
+        return self.wait_time() == 0 and self.tokens >= self.capacity
+
+
+class DeliveryJob:
+    """One rendered message for one chat."""
+
+    __slots__ = (
+        "bot",
+        "chat_id",
+        "message",
+        "future",
+        "attempts",
+        "before_send",
+        "on_error",
+    )
+
+    def __init__(self, bot, chat_id, message, future, before_send=None, on_error=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message = message
+        self.future = future
+        self.attempts = 0
+        self.before_send = before_send
+        self.on_error = on_error
+
+
+class DeliveryScheduler:
+    """Bounded worker pool draining per-chat queues under rate limits."""
+
+    def __init__(
+        self,
+        workers=WORKERS,
+        global_rate=GLOBAL_RATE,
+        per_chat_rate=PER_CHAT_RATE,
+        max_pending=MAX_PENDING,
+    ):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_pending = max_pending
+        self.chat_buckets = {}
+        self.pending = {}
+        self.loop = None
+        self.tasks = []
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        # A new event loop (e.g. another asyncio.run) needs its own workers
+        self.loop = loop
+        self.ready = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self.pending = {}
+        self.tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def enqueue(self, bot, chat_id, message, before_send=None, on_error=None):
+        """
+        Queue a RenderedPost and return a future resolving to True once sent.
+
+        before_send is called right before every send attempt, on_error with
+        the exception when the message could not be sent. Waits while
+        max_pending messages are already queued.
+        """
+        self._ensure_started()
+        await self.slots.acquire()
+        future = self.loop.create_future()
+        job = DeliveryJob(bot, chat_id, message, future, before_send, on_error)
+        if chat_id in self.pending:
+            self.pending[chat_id].append(job)
+        else:
+            self.pending[chat_id] = deque([job])
+            self.ready.put_nowait(chat_id)
+        return future
+
+    async def send(self, bot, chat_id, message, before_send=None):
+        """Queue a RenderedPost and wait until it was delivered."""
+        return await (await self.enqueue(bot, chat_id, message, before_send))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.loop = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > self.max_pending:
+                self.chat_buckets = {
+                    cid: b
+                    for cid, b in self.chat_buckets.items()
+                    if cid in self.pending or not b.idle()
+                }
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _reschedule(self, chat_id, delay):
+        self.loop.call_later(delay, self.ready.put_nowait, chat_id)
+
+    def _fail(self, job, error):
+        print(f"Failed to send message to user {job.chat_id}: {error}")
+        if job.on_error is not None:
+            job.on_error(error)
+        self._finish(job, False)
+
+    def _finish(self, job, result):
+        if not job.future.done():
+            job.future.set_result(result)
+        self.slots.release()
+
+    async def _worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            jobs = self.pending.get(chat_id)
+            if not jobs:
+                self.pending.pop(chat_id, None)
+                continue
+
+            bucket = self._chat_bucket(chat_id)
+            delay = bucket.wait_time()
+            if delay > 0:
+                self._reschedule(chat_id, delay)
+                continue
+            bucket.consume()
+
+            job = jobs.popleft()
+            await self.global_bucket.acquire()
+            try:
+                if job.before_send is not None:
+                    job.before_send()
+                await self._send(job)
+                self._finish(job, True)
+            except telegram.error.RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                job.attempts += 1
+                if job.attempts < MAX_ATTEMPTS:
+                    # Only this chat waits, the other chats keep flowing
+                    bucket.pause(retry_after)
+                    jobs.appendleft(job)
+                else:
+                    self._fail(job, e)
+            except asyncio.CancelledError:
+                self._finish(job, False)
+                raise
+            except Exception as e:
+                self._fail(job, e)
+
+            if jobs:
+                self._reschedule(chat_id, bucket.wait_time())
+            else:
+                del self.pending[chat_id]
+
+    async def _send(self, job):
+        await job.bot.send_message(
+            chat_id=job.chat_id,
+            text=job.message.text,
+            parse_mode=job.message.parse_mode,
+        )
+
+
+# Process-wide scheduler shared by the sender and the bot handlers
+scheduler = DeliveryScheduler()
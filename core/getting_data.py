@@ -1,3 +1,9 @@
+import html
+import re
+
+from core.channels import channel_message_id, channels
+
+
 def to_json(lst):
     dct = {"needs": lst[0]}
     dct["text"] = lst[1]
@@ -6,6 +12,12 @@ def to_json(lst):
     return dct
 
 
+def post_link(dct):
+    """Link to the post in its channel."""
+    channel = channels.for_post(dct)
+    return channel.link(channel_message_id(dct["message_id"]))
+
+
 def to_text(dct):
     text = f"{dct['needs']}\n"
 
@@ -13,80 +25,67 @@ def to_text(dct):
     text += " ".join(dct["hashtags"]) + "\n"
     # Add direct message link if message_id exists
     if "message_id" in dct and dct["message_id"]:
-        message_url = f"https://t.me/UstozShogird/{dct['message_id']}"
-        text += f"__👉__ [@UstozShogird kanaliga ulanish]({message_url})\n"
+        message_url = post_link(dct)
+        username = channels.for_post(dct).username
+        text += f"__👉__ [@{username} kanaliga ulanish]({message_url})\n"
     else:
         text += dct["url"] + "\n"
 
     return text
 
 
-def clean_markdown_for_telegram(text):
-    """Clean and fix Markdown formatting for Telegram."""
-    import re
-
-    try:
-        # Fix double asterisks (bold) - convert to single asterisks for Telegram
-        text = re.sub(r"\*\*(.*?)\*\*", r"*\1*", text)
-
-        # Fix double underscores (italic) - convert to underscores for Telegram
-        text = re.sub(r"__(.*?)__", r"_\1_", text)
-
-        # KEEP markdown links intact - DON'T remove [text](url) format
-        # Just ensure they are properly formatted for Telegram
-
-        # Handle unclosed markdown - remove orphaned * and _
-        # But be careful not to remove * and _ that are part of links
-
-        # Count asterisks outside of links
-        text_without_links = re.sub(r"\[([^\]]+)\]\([^)]+\)", "", text)
-        asterisk_count = text_without_links.count("*")
-        if asterisk_count % 2 != 0:
-            # Find last asterisk that's not part of a link and remove it
-            parts = text.split("[")
-            if len(parts) > 1:
-                # Only clean asterisks in the first part (before any links)
-                parts[0] = re.sub(r"\*(?![^[]*\])", "", parts[0], count=1)
-                text = "[".join(parts)
-            else:
-                last_asterisk = text.rfind("*")
-                if last_asterisk != -1:
-                    text = text[:last_asterisk] + text[last_asterisk + 1 :]
-
-        # Count underscores outside of links
-        underscore_count = text_without_links.count("_")
-        if underscore_count % 2 != 0:
-            # Find last underscore that's not part of a link and remove it
-            parts = text.split("[")
-            if len(parts) > 1:
-                # Only clean underscores in the first part (before any links)
-                parts[0] = re.sub(r"_(?![^[]*\])", "", parts[0], count=1)
-                text = "[".join(parts)
-            else:
-                last_underscore = text.rfind("_")
-                if last_underscore != -1:
-                    text = text[:last_underscore] + text[last_underscore + 1 :]
-
-        # Remove problematic characters but preserve link structure
-        text = text.replace("`", "'")
-        # Don't remove pipes that might be in URLs
-
-        return text
-    except Exception:
-        # If markdown cleaning fails, return plain text without any formatting
-        return remove_all_markdown(text)
-
-
-def remove_all_markdown(text):
-    """Remove all markdown formatting as a fallback."""
-    import re
-
-    # Remove all markdown formatting
-    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)  # Remove ** bold **
-    text = re.sub(r"\*(.*?)\*", r"\1", text)  # Remove * italic *
-    text = re.sub(r"__(.*?)__", r"\1", text)  # Remove __ italic __
-    text = re.sub(r"_(.*?)_", r"\1", text)  # Remove _ italic _
-    text = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", text)  # Remove links
-    text = re.sub(r"`([^`]+)`", r"\1", text)  # Remove inline code
-
-    return text
+# Telethon gives us the channel text as Markdown (**bold**, __italic__,
+# `code`, ```pre```, ~~strike~~, [text](url)). One compiled alternation
+# tokenizes it left to right; bare URLs are matched first so their
+# underscores and asterisks are never read as formatting.
+MARKDOWN_TOKEN_RE = re.compile(
+    r"(?P<url>https?://[^\s<>()\[\]]+)"
+    r"|```(?:[\w+-]*\n)?(?P<pre>.+?)```"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>[^)\s]+)\)"
+    r"|\*\*(?P<bold>.+?)\*\*"
+    r"|__(?P<italic>.+?)__"
+    r"|~~(?P<strike>.+?)~~",
+    re.S,
+)
+
+NESTED_TAGS = {"bold": "b", "italic": "i", "strike": "s"}
+
+
+def markdown_to_html(text):
+    """
+    Convert Telethon-style Markdown to Telegram HTML in one pass.
+
+    Everything that is not a complete formatting token is escaped, so the
+    result is always valid for parse_mode=HTML: an unclosed ** or a stray
+    _ stays literal text instead of making Telegram reject the message.
+    """
+    parts = []
+    position = 0
+    for match in MARKDOWN_TOKEN_RE.finditer(text):
+        parts.append(html.escape(text[position : match.start()], quote=False))
+        position = match.end()
+
+        kind = match.lastgroup
+        if kind == "url":
+            parts.append(html.escape(match.group("url"), quote=False))
+        elif kind == "pre":
+            parts.append(f"<pre>{html.escape(match.group('pre'), quote=False)}</pre>")
+        elif kind == "code":
+            parts.append(
+                f"<code>{html.escape(match.group('code'), quote=False)}</code>"
+            )
+        elif kind == "link_url":
+            url = html.escape(match.group("link_url"), quote=True)
+            label = markdown_to_html(match.group("link_text"))
+            parts.append(f'<a href="{url}">{label}</a>')
+        else:
+            tag = NESTED_TAGS[kind]
+            parts.append(f"<{tag}>{markdown_to_html(match.group(kind))}</{tag}>")
+    parts.append(html.escape(text[position:], quote=False))
+    return "".join(parts)
+
+
+def render_post(dct):
+    """Return the post as Telegram HTML."""
+    return markdown_to_html(str(to_text(dct)))
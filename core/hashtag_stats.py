@@ -0,0 +1,136 @@
+"""
+In-memory hashtag usage counts.
+
+The listener and the hashtag collector increment a Counter in O(1) instead
+of reading and rewriting the hashtag table for every tag. The increments
+are flushed to storage as one batch every FLUSH_INTERVAL seconds.
+
+The TOP_K most used hashtags are kept as a small sorted leaderboard that is
+updated on every increment, so the bot reads them without sorting every
+hashtag; version changes whenever the leaderboard does. Readers reload the
+counts once the stored hashtag table changed, e.g. when the listener runs
+in another process than the bot.
+"""
+
+import asyncio
+import threading
+import time
+from collections import Counter
+
+from core.hashtags import hashtag_aliases
+from core.repository import get_repository
+
+FLUSH_INTERVAL = 5  # seconds
+TOP_K = 10
+
+
+class HashtagStats:
+    """All-time hashtag counts with batched writes of the deltas."""
+
+    def __init__(self, repository=None, flush_interval=FLUSH_INTERVAL, top_k=TOP_K):
+        self.repository = repository
+        self.flush_interval = flush_interval
+        self.top_k = top_k
+        self.counts = None
+        # Version of the stored hashtag table the counts were read at
+        self.stored_version = None
+        self.leaderboard = []
+        self.version = 0
+        self.deltas = Counter()
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def _load(self, reload=False):
+        """The counts, read again when reload is set and storage changed."""
+        if self.counts is not None and not (reload and self._stale()):
+            return self.counts
+        with self.lock:
+            if self.counts is not None and not (reload and self._stale()):
+                return self.counts
+            if self.repository is None:
+                self.repository = get_repository()
+            stored_version = self.repository.version("hashtags")
+            # Rows saved before aliases are merged into their canonical tag
+            counts = Counter()
+            for h in self.repository.all_hashtags():
+                tag = hashtag_aliases.canonical(h["hashtag"])
+                if tag:
+                    counts[tag] += h["count"]
+            # Increments that are not flushed yet
+            counts.update(self.deltas)
+            self._rebuild_leaderboard(counts)
+            self.counts = counts
+            self.stored_version = stored_version
+        return self.counts
+
+    def _stale(self):
+        return self.repository.version("hashtags") != self.stored_version
+
+    def _rebuild_leaderboard(self, counts):
+        # Hashtags of deleted posts can drop to zero
+        self.leaderboard = sorted((-c, h) for h, c in counts.items() if c > 0)[
+            : self.top_k
+        ]
+        self.version += 1
+
+    def _update_leaderboard(self, hashtag, count):
+        # Counts only grow, so a hashtag can only enter by its own increment
+        board = self.leaderboard
+        for i, (_, h) in enumerate(board):
+            if h == hashtag:
+                board[i] = (-count, hashtag)
+                break
+        else:
+            if len(board) >= self.top_k and (-count, hashtag) >= board[-1]:
+                return
+            board.append((-count, hashtag))
+        board.sort()
+        del board[self.top_k :]
+        self.version += 1
+
+    def increment(self, hashtag, amount=1):
+        counts = self._load()
+        with self.lock:
+            counts[hashtag] += amount
+            self.deltas[hashtag] += amount
+            if amount > 0:
+                self._update_leaderboard(hashtag, counts[hashtag])
+            else:
+                self._rebuild_leaderboard(counts)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def count(self, hashtag):
+        return self._load(reload=True)[hashtag]
+
+    def top(self, n=TOP_K):
+        """The n (at most top_k) most used hashtags as (hashtag, count)."""
+        self._load(reload=True)
+        return [(hashtag, -count) for count, hashtag in self.leaderboard[:n]]
+
+    def refresh(self):
+        """Pick up counts written by other processes, return the version."""
+        self._load(reload=True)
+        return self.version
+
+    def flush(self):
+        """Write the pending increments to storage in one batch."""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            deltas, self.deltas = self.deltas, Counter()
+        if deltas:
+            self.repository.increment_hashtags(dict(deltas))
+
+    async def run(self, interval=None):
+        """Flush the pending increments every interval seconds."""
+        interval = interval or self.flush_interval
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.flush()
+        finally:
+            self.flush()
+
+
+# Process-wide counts shared by the listener and the bot handlers
+hashtag_stats = HashtagStats()
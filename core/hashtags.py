@@ -0,0 +1,160 @@
+"""
+Hashtag normalisation, aliases and interned ids.
+
+Every hashtag that enters the bot, from a post at ingest or from a user at
+subscribe time, goes through canonical(): NFKC, casefolded, stripped of
+whitespace and trailing punctuation, then mapped through the alias table
+(e.g. #js -> #javascript). So #Python, #python and "#python\\n" are one key.
+
+The alias table is data_json/hashtag_aliases.json ({"#alias": "#target"}),
+edited by admins with /alias or by hand; every process picks up changes
+within ALIASES_CHECK_INTERVAL seconds.
+
+Canonical hashtags are interned to small integer ids for the matchers.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import unicodedata
+
+ALIASES_PATH = "data_json/hashtag_aliases.json"
+ALIASES_CHECK_INTERVAL = 5  # seconds
+TRAILING_PUNCTUATION = ".,;:!?)»\"'"
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_hashtag(tag):
+    """NFKC, casefolded #tag without surrounding whitespace or punctuation."""
+    tag = unicodedata.normalize("NFKC", tag).strip().rstrip(TRAILING_PUNCTUATION)
+    tag = tag.casefold()
+    if not tag.startswith("#"):
+        tag = "#" + tag
+    return tag if len(tag) > 1 else None
+
+
+class HashtagAliases:
+    """Admin-editable alias -> canonical hashtag map, reloaded on change."""
+
+    def __init__(self, path=ALIASES_PATH, check_interval=ALIASES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.aliases = {}
+        self.mtime = None
+        self.checked = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def sync(self):
+        """Reload the table if the file changed, return its version."""
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.check_interval:
+            return self.version
+        self.checked = now
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime != self.mtime:
+            with self.lock:
+                aliases = {}
+                if mtime is not None:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        try:
+                            aliases = json.load(f)
+                        except ValueError:
+                            print(f"Ignoring invalid alias table {self.path}")
+                self._set_table(aliases)
+                self.mtime = mtime
+        return self.version
+
+    def _set_table(self, aliases):
+        table = {}
+        for alias, target in aliases.items():
+            alias, target = normalize_hashtag(alias), normalize_hashtag(target)
+            if alias and target and alias != target:
+                table[alias] = target
+        # Resolve chains like #js -> #ecmascript -> #javascript once here
+        for alias in table:
+            target, hops = table[alias], 0
+            while target in table and hops < len(table):
+                target, hops = table[target], hops + 1
+            table[alias] = target
+        self.aliases = {a: t for a, t in table.items() if a != t}
+        self.version += 1
+
+    def canonical(self, tag):
+        """The canonical form of a hashtag, None for an empty one."""
+        tag = normalize_hashtag(tag)
+        if tag is None:
+            return None
+        self.sync()
+        return self.aliases.get(tag, tag)
+
+    def canonical_all(self, tags):
+        """Canonical hashtags in their first-seen order, without duplicates."""
+        self.sync()
+        aliases = self.aliases
+        result = []
+        seen = set()
+        for tag in tags:
+            tag = normalize_hashtag(tag)
+            tag = aliases.get(tag, tag)
+            if tag and tag not in seen:
+                seen.add(tag)
+                result.append(tag)
+        return result
+
+    def set_alias(self, alias, target):
+        self.sync()
+        aliases = dict(self.aliases)
+        aliases[alias] = target
+        self._save(aliases)
+
+    def remove_alias(self, alias):
+        self.sync()
+        aliases = dict(self.aliases)
+        aliases.pop(normalize_hashtag(alias), None)
+        self._save(aliases)
+
+    def _save(self, aliases):
+        with self.lock:
+            self._set_table(aliases)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.aliases, f, ensure_ascii=False, indent=4, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+
+
+class HashtagIds:
+    """Interns canonical hashtags to small integer ids."""
+
+    def __init__(self):
+        self.ids = {}
+        self.tags = []
+        self.lock = threading.Lock()
+
+    def intern(self, tag):
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            with self.lock:
+                tag_id = self.ids.get(tag)
+                if tag_id is None:
+                    tag_id = self.ids[tag] = len(self.tags)
+                    self.tags.append(tag)
+        return tag_id
+
+    def get(self, tag):
+        """Id of an already interned hashtag, None otherwise."""
+        return self.ids.get(tag)
+
+    def tag(self, tag_id):
+        return self.tags[tag_id]
+
+
+# Process-wide alias table and id space
+hashtag_aliases = HashtagAliases()
+hashtag_ids = HashtagIds()
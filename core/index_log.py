@@ -0,0 +1,152 @@
+"""
+Append-only change log kept next to a saved index.
+
+Writing a whole index after every post costs time proportional to the
+index, so the hashtag and text indexes append each add and remove to
+<index>.log as one JSON line instead, and only write the full index (and
+empty the log) once the log is as large as the saved index. Every post is
+then written a constant number of times on average.
+
+Loading reads the saved index and replays the log on top of it. Records are
+replayed idempotently, so a process simply reads the log from where it
+stopped, picking up the records of other processes and its own alike.
+
+LoggedIndex holds the saving, loading and syncing shared by the indexes;
+they only supply their payload and how to apply a record.
+"""
+
+import json
+import os
+
+COMPACT_MIN_SIZE = 1 << 20  # bytes of log before a full save is worth it
+
+
+class IndexLog:
+    """JSON lines appended to a file, read incrementally."""
+
+    def __init__(self, path):
+        self.path = path
+        # Bytes of the log already read
+        self.offset = 0
+
+    def append(self, records):
+        if not records:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+    def read(self):
+        """Records appended since the last read, by any process."""
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    # Emptied by a full save of another process
+                    self.offset = 0
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            self.offset = 0
+            return []
+        # Only whole lines, another process may be halfway through a write
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return [json.loads(line) for line in data[:end].splitlines() if line]
+
+    def due(self, index_path):
+        """Whether the log grew large enough to fold it into the saved index."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return False
+        try:
+            saved = os.path.getsize(index_path)
+        except FileNotFoundError:
+            return True
+        return size >= max(COMPACT_MIN_SIZE, saved)
+
+    def reset(self):
+        """Empty the log once the full index was saved."""
+        with open(self.path, "w", encoding="utf-8"):
+            pass
+        self.offset = 0
+
+
+class LoggedIndex:
+    """
+    An index saved as one JSON file plus its change log.
+
+    Subclasses implement build, _payload, _restore, _indexed, _replay_add
+    and _replay_remove, call clear() when they reset their data and put the
+    record of every add and remove in pending.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.log = IndexLog(f"{path}.log")
+        # Changes not yet written to the log
+        self.pending = []
+        self.rewrite = False
+
+    def clear(self):
+        self.pending = []
+        self.rewrite = True
+
+    def current(self):
+        """Whether the loaded index can be used as it is."""
+        return True
+
+    def _replay(self):
+        """Apply the log records written since the last read."""
+        for record in self.log.read():
+            if "add" in record:
+                if not self._indexed(record["add"]):
+                    self._replay_add(record)
+            elif self._indexed(record["remove"]):
+                self._replay_remove(record)
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            self._restore(json.load(f))
+        self.mtime = os.path.getmtime(self.path)
+        self.log.offset = 0
+        self._replay()
+
+    def save(self):
+        """
+        Append the changes since the last save to the log, and write the
+        whole index instead once the log grew as large as the index.
+        """
+        if not self.rewrite and not self.log.due(self.path):
+            self.log.append(self.pending)
+            self.pending = []
+            return
+        # Fold in what other processes logged before the log is emptied
+        self._replay()
+        self.write()
+
+    def write(self):
+        """Write the index atomically next to the data files."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._payload(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.mtime = os.path.getmtime(self.path)
+        self.log.reset()
+        self.pending = []
+        self.rewrite = False
+
+    def sync(self, storage):
+        """
+        Load the index if another process changed it, or build it from the
+        stored posts when it is missing or no longer current.
+        """
+        if os.path.exists(self.path):
+            if os.path.getmtime(self.path) != self.mtime:
+                self.load()
+            else:
+                self._replay()
+            if self.current():
+                return
+        self.build(storage.all_posts())
+        self.save()
@@ -0,0 +1,145 @@
+"""
+Bitset matching of subscriptions against post hashtags.
+
+A subscription is compiled once into integer bitmasks over the interned
+hashtag ids of core.hashtags (bit i set = hashtag id i), and a post's
+hashtags into one mask, so every match mode is a couple of bitwise ops:
+
+    any       mask & post != 0
+    all       mask & post == mask
+    advanced  required & post == required and (not optional or optional & post)
+    query     the compiled predicate of a boolean query (core.query)
+
+With NumPy installed, VectorMatcher packs the masks of every user into
+uint64 arrays and matches one post against all of them at once.
+"""
+
+from core.hashtags import hashtag_aliases, hashtag_ids
+from core.query import QuerySyntaxError, compile_query
+
+try:
+    import numpy as np
+except ImportError:  # optional, only the vectorised path needs it
+    np = None
+
+ANY, ALL, ADVANCED, QUERY = 0, 1, 2, 3
+MODES = {"any": ANY, "all": ALL, "advanced": ADVANCED, "query": QUERY}
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def hashtag_mask(hashtags, intern=False):
+    """
+    Bitmask of a list of hashtags. Without intern, hashtags nobody
+    subscribed to (never interned) are left out.
+    """
+    mask = 0
+    for tag in hashtag_aliases.canonical_all(hashtags):
+        tag_id = hashtag_ids.intern(tag) if intern else hashtag_ids.get(tag)
+        if tag_id is not None:
+            mask |= 1 << tag_id
+    return mask
+
+
+def mask_ids(mask):
+    """The hashtag ids set in a mask."""
+    ids = []
+    while mask:
+        low = mask & -mask
+        ids.append(low.bit_length() - 1)
+        mask ^= low
+    return ids
+
+
+class Subscription:
+    """One user's hashtags, compiled to bitmasks."""
+
+    __slots__ = ("user_id", "mode", "mask", "required", "optional", "query")
+
+    def __init__(self, user_id, mode, mask, required, optional, query=None):
+        self.user_id = user_id
+        self.mode = mode
+        self.mask = mask
+        self.required = required
+        self.optional = optional
+        self.query = query
+
+    def matches(self, post_mask):
+        if self.mode == QUERY:
+            return self.query.predicate(post_mask)
+        if self.mode == ADVANCED:
+            # (ALL required) AND (ANY optional), empty groups are ignored
+            if self.required & post_mask != self.required:
+                return False
+            return not self.optional or bool(self.optional & post_mask)
+        if self.mode == ALL:
+            return self.mask & post_mask == self.mask
+        return bool(self.mask & post_mask)
+
+
+def compile_subscription(user):
+    """Compile a user record, None for users without hashtags or query."""
+    mode = MODES.get(user.get("match_mode", "any"), ANY)
+    if mode == QUERY:
+        try:
+            query = compile_query(user.get("query") or "")
+        except QuerySyntaxError:
+            return None
+        return Subscription(user["id"], QUERY, query.mask, 0, 0, query)
+
+    mask = hashtag_mask(user.get("hashtags", []), intern=True)
+    # Users without hashtags never receive real-time messages
+    if not mask:
+        return None
+    return Subscription(
+        user["id"],
+        mode,
+        mask,
+        hashtag_mask(user.get("required_hashtags", []), intern=True),
+        hashtag_mask(user.get("optional_hashtags", []), intern=True),
+    )
+
+
+class VectorMatcher:
+    """
+    Every any/all/advanced subscription as rows of uint64 words, matched
+    with NumPy. Query subscriptions are left to Subscription.matches.
+    """
+
+    def __init__(self, subscriptions):
+        subscriptions = [s for s in subscriptions if s.mode != QUERY]
+        self.user_ids = np.array([s.user_id for s in subscriptions], dtype=np.int64)
+        self.modes = np.array([s.mode for s in subscriptions], dtype=np.int8)
+        widest = max(
+            (max(s.mask, s.required, s.optional).bit_length() for s in subscriptions),
+            default=0,
+        )
+        self.words = max(1, -(-widest // WORD_BITS))
+        self.masks = self._pack([s.mask for s in subscriptions])
+        self.required = self._pack([s.required for s in subscriptions])
+        self.optional = self._pack([s.optional for s in subscriptions])
+        self.has_optional = self.optional.any(axis=1)
+
+    def _words(self, mask):
+        return [(mask >> (WORD_BITS * i)) & WORD_MASK for i in range(self.words)]
+
+    def _pack(self, masks):
+        return np.array([self._words(mask) for mask in masks], dtype=np.uint64).reshape(
+            len(masks), self.words
+        )
+
+    def match(self, post_mask):
+        """Ids of every user whose subscription matches the post mask."""
+        post = np.array(self._words(post_mask), dtype=np.uint64)
+        hits = self.masks & post
+        any_hit = hits.any(axis=1)
+        all_hit = (hits == self.masks).all(axis=1)
+        advanced_hit = ((self.required & post) == self.required).all(axis=1) & (
+            (self.optional & post).any(axis=1) | ~self.has_optional
+        )
+        matched = np.where(
+            self.modes == ANY,
+            any_hit,
+            np.where(self.modes == ALL, all_hit, advanced_hit),
+        )
+        return set(self.user_ids[matched].tolist())
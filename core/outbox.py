@@ -0,0 +1,217 @@
+"""
+Crash-safe delivery of posts to users.
+
+Before a post is handed to the delivery scheduler, one outbox entry per
+(user_id, message_id) is written to storage. The pair is the dedupe key, so
+a user never gets the same post twice, and the entry state tells a
+restarted process where delivery stopped:
+
+    pending -> queued -> sending -> sent
+                                 -> pending (retry later) -> ... -> failed
+                                 -> failed (blocked bot, rejected message)
+
+The bot, the listener and the send_data cron may run as separate processes
+on the same outbox, so a process only queues entries it claimed: the claim
+moves a pending entry to "queued" under the process's lease, and only one
+process can win it. The lease is renewed while the process runs; once it
+expired (the process died), queued entries become pending again and
+entries still "sending", which may or may not have reached the user, are
+marked "unknown" instead of being sent again.
+"""
+
+import asyncio
+import datetime
+import os
+import socket
+import uuid
+
+from core.delivery import is_transient, scheduler
+from core.rendering import render_cache
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60  # seconds, doubled after every failed attempt
+DRAIN_INTERVAL = 30  # seconds, also how often leases are renewed
+LEASE = 10 * 60  # seconds
+
+
+def now_iso():
+    return datetime.datetime.now().isoformat()
+
+
+def lease_until():
+    return (datetime.datetime.now() + datetime.timedelta(seconds=LEASE)).isoformat()
+
+
+class Outbox:
+    """Writes outbox entries, feeds them to the scheduler and records results."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.in_flight = set()
+        self._owner = None
+
+    @property
+    def owner(self):
+        """Lease owner id of this process."""
+        if self._owner is None:
+            self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        return self._owner
+
+    async def deliver(self, bot, repository, post, user_ids):
+        """
+        Record and queue a post for users that did not get it yet.
+
+        Returns the scheduler futures of the newly queued messages.
+        """
+        message_id = post["message_id"]
+        # Inserted already claimed, the key is new so no other process has it
+        entries = repository.insert_outbox(
+            [
+                {
+                    "user_id": user_id,
+                    "message_id": message_id,
+                    "state": "queued",
+                    "attempts": 0,
+                    "next_attempt_at": now_iso(),
+                    "owner": self.owner,
+                    "lease_until": lease_until(),
+                }
+                for user_id in user_ids
+            ]
+        )
+        futures = []
+        for entry in entries:
+            future = await self._try_enqueue(bot, repository, dict(entry), post)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def renew(self, repository):
+        """Keep the entries this process queued from being taken over."""
+        if self.in_flight:
+            repository.renew_outbox(self.owner, lease_until())
+
+    def recover(self, repository):
+        """Hand back the entries of processes whose lease expired."""
+        queued, sending = repository.release_outbox(now_iso())
+        if queued or sending:
+            print(
+                f"Outbox: {queued} abandoned deliveries pending again, "
+                f"{sending} interrupted deliveries marked unknown"
+            )
+
+    async def drain_once(self, bot, repository):
+        """Claim and queue every pending entry that is due, return their futures."""
+        now = now_iso()
+        due = [
+            entry
+            for entry in repository.outbox_entries(["pending"])
+            if (entry.get("next_attempt_at") or "") <= now
+        ]
+
+        futures = []
+        posts = {}
+        for entry in due:
+            user_id, message_id = entry["user_id"], entry["message_id"]
+            if not repository.claim_outbox(
+                user_id, message_id, self.owner, lease_until()
+            ):
+                # Queued by another process in the meantime
+                continue
+            if message_id not in posts:
+                posts[message_id] = repository.get_post(message_id)
+            post = posts[message_id]
+            if post is None:
+                repository.update_outbox(user_id, message_id, {"state": "failed"})
+                continue
+            future = await self._try_enqueue(bot, repository, dict(entry), post)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    async def run(self, bot, repository, interval=DRAIN_INTERVAL):
+        """Keep renewing leases, resuming abandoned work and draining due entries."""
+        while True:
+            try:
+                self.renew(repository)
+                self.recover(repository)
+                await self.drain_once(bot, repository)
+            except Exception as e:
+                # A locked database or a bad entry must not stop the bot
+                print(f"Outbox: drain failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def wait(self, repository, futures, interval=DRAIN_INTERVAL):
+        """Gather the futures of queued entries, renewing their lease meanwhile."""
+        gathered = asyncio.gather(*futures)
+        while True:
+            try:
+                return await asyncio.wait_for(asyncio.shield(gathered), interval)
+            except asyncio.TimeoutError:
+                self.renew(repository)
+
+    async def _try_enqueue(self, bot, repository, entry, post):
+        """_enqueue, giving a claimed entry back for a retry when it fails."""
+        try:
+            return await self._enqueue(bot, repository, entry, post)
+        except Exception as e:
+            print(
+                f"Outbox: could not queue message {entry['message_id']} "
+                f"for user {entry['user_id']}: {e}"
+            )
+            entry["attempts"] += 1
+            entry["transient"] = True
+            fields = self._retry_fields(entry)
+            fields["attempts"] = entry["attempts"]
+            repository.update_outbox(entry["user_id"], entry["message_id"], fields)
+            return None
+
+    async def _enqueue(self, bot, repository, entry, post):
+        user_id, message_id = entry["user_id"], entry["message_id"]
+        message = render_cache.get(post)
+
+        def before_send():
+            entry["attempts"] += 1
+            repository.update_outbox(
+                user_id,
+                message_id,
+                {
+                    "state": "sending",
+                    "attempts": entry["attempts"],
+                    "lease_until": lease_until(),
+                },
+            )
+
+        def on_error(error):
+            entry["transient"] = is_transient(error)
+
+        future = await self.scheduler.enqueue(
+            bot, user_id, message, before_send=before_send, on_error=on_error
+        )
+        self.in_flight.add((user_id, message_id))
+        future.add_done_callback(lambda f: self._finished(repository, entry, f))
+        return future
+
+    def _finished(self, repository, entry, future):
+        user_id, message_id = entry["user_id"], entry["message_id"]
+        self.in_flight.discard((user_id, message_id))
+        if future.cancelled():
+            # Shutdown while queued: still pending if it never started
+            fields = {"state": "pending" if entry["attempts"] == 0 else "unknown"}
+        elif future.result():
+            fields = {"state": "sent", "sent_at": now_iso()}
+        else:
+            fields = self._retry_fields(entry)
+        repository.update_outbox(user_id, message_id, fields)
+
+    def _retry_fields(self, entry):
+        """Pending again after a backoff, or failed for good."""
+        if not entry.get("transient") or entry["attempts"] >= MAX_ATTEMPTS:
+            return {"state": "failed"}
+        delay = RETRY_DELAY * 2 ** max(entry["attempts"] - 1, 0)
+        next_attempt_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+        return {"state": "pending", "next_attempt_at": next_attempt_at.isoformat()}
+
+
+# Process-wide outbox in front of the shared scheduler
+outbox = Outbox(scheduler)
@@ -0,0 +1,81 @@
+"""
+Staged asyncio pipeline for ingesting new posts.
+
+The Telethon handler only puts the raw message into the first stage's
+queue; every stage has its own bounded queue and a number of workers that
+pass their results on to the next stage. A full queue makes the stage in
+front of it wait, so a burst of posts slows down the intake instead of
+piling up in memory, and a slow fan-out no longer blocks parsing.
+
+Handlers may be plain functions or coroutines. A handler returning None
+drops the item, anything else is handed to the next stage.
+"""
+
+import asyncio
+import inspect
+
+QUEUE_SIZE = 100
+
+
+class Stage:
+    """A named handler with its own bounded queue and worker count."""
+
+    def __init__(self, name, handler, concurrency=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue = None
+        self.next = None
+        self.tasks = []
+
+    def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                result = self.handler(item)
+                if inspect.isawaitable(result):
+                    result = await result
+                if result is not None and self.next is not None:
+                    # Waits while the next stage is full
+                    await self.next.queue.put(result)
+            except Exception as e:
+                print(f"Error in {self.name} stage: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """Stages run in order, each feeding the next one's queue."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    async def submit(self, item):
+        """Queue an item for the first stage, waiting while it is full."""
+        await self.stages[0].queue.put(item)
+
+    async def join(self):
+        """Wait until every queued item went through every stage."""
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def stop(self):
+        tasks = [task for stage in self.stages for task in stage.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stage in self.stages:
+            stage.tasks = []
@@ -0,0 +1,302 @@
+"""
+Persistent hashtag -> sorted message_id posting lists.
+
+Lets the digest and search answer any/all/advanced hashtag queries with
+union and intersection of sorted lists instead of scanning every post in
+data.json.
+
+Every list is ordered by (date, message_id), so the newest matches are read
+from the end of the lists and a search for the latest N stops after N.
+
+Hashtags are keyed by their canonical form (core.hashtags); the index is
+rebuilt when the alias table it was built with changed. Changes between two
+full saves go to an append-only log (core.index_log).
+"""
+
+import datetime
+import heapq
+from bisect import bisect_left, insort
+from itertools import islice, takewhile
+
+from core.hashtags import hashtag_aliases
+from core.index_log import LoggedIndex
+from core.query import QuerySyntaxError, compile_query, evaluate_sets
+
+# Bumped whenever the layout of the saved index changes
+INDEX_VERSION = 2
+
+
+def timestamp_of(date):
+    """POSIX seconds of an ISO date string, 0 if unknown."""
+    try:
+        date = datetime.datetime.fromisoformat(date)
+    except (TypeError, ValueError):
+        return 0
+    if date.tzinfo is None:
+        date = date.astimezone()
+    return int(date.timestamp())
+
+
+class PostIndex(LoggedIndex):
+    """
+    Hashtag -> message ids, plus the ids of every post, all ordered by
+    (date, message_id).
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.postings = {}
+        self.message_ids = []
+        self.known = set()
+        # message_id -> POSIX seconds of the post date
+        self.dates = {}
+        self.aliases = None
+        self.version = None
+
+    def key(self, message_id):
+        """Sort key of a message id."""
+        return (self.dates.get(message_id, 0), message_id)
+
+    def clear(self):
+        self.postings = {}
+        self.message_ids = []
+        self.known = set()
+        self.dates = {}
+        self.version = INDEX_VERSION
+        hashtag_aliases.sync()
+        self.aliases = dict(hashtag_aliases.aliases)
+        super().clear()
+
+    def build(self, documents):
+        """Rebuild the index from every post of the data table."""
+        self.clear()
+        for doc in documents:
+            if doc.get("message_id") is None:
+                continue
+            self._add(doc["message_id"], doc.get("hashtags", []), doc.get("date"))
+
+    def add(self, message_id, hashtags, date=None):
+        """Index one post. Adding an already indexed post is a no-op."""
+        if message_id in self.known:
+            return
+        self._add(message_id, hashtags, date)
+        self.pending.append({"add": message_id, "hashtags": hashtags, "date": date})
+
+    def remove(self, message_id, hashtags):
+        """Drop a post, given the hashtags it was indexed with."""
+        if message_id not in self.known:
+            return
+        self._remove(message_id, hashtags)
+        self.pending.append({"remove": message_id, "hashtags": hashtags})
+
+    def _add(self, message_id, hashtags, date):
+        self.known.add(message_id)
+        self.dates[message_id] = timestamp_of(date)
+        self._insert(self.message_ids, message_id)
+        for tag in hashtag_aliases.canonical_all(hashtags):
+            self._insert(self.postings.setdefault(tag, []), message_id)
+
+    def _remove(self, message_id, hashtags):
+        self._discard(self.message_ids, message_id)
+        for tag in hashtag_aliases.canonical_all(hashtags):
+            lst = self.postings.get(tag)
+            if lst is None:
+                continue
+            self._discard(lst, message_id)
+            if not lst:
+                del self.postings[tag]
+        self.known.discard(message_id)
+        self.dates.pop(message_id, None)
+
+    def _indexed(self, message_id):
+        return message_id in self.known
+
+    def _replay_add(self, record):
+        self._add(record["add"], record["hashtags"], record["date"])
+
+    def _replay_remove(self, record):
+        self._remove(record["remove"], record["hashtags"])
+
+    def _restore(self, raw):
+        self.postings = raw.get("hashtags", {})
+        self.message_ids = raw.get("message_ids", [])
+        self.known = set(self.message_ids)
+        # JSON object keys are strings, message ids are ints
+        self.dates = {int(m): d for m, d in raw.get("dates", {}).items()}
+        self.aliases = raw.get("aliases")
+        self.version = raw.get("version")
+
+    def _payload(self):
+        return {
+            "hashtags": self.postings,
+            "message_ids": self.message_ids,
+            "dates": self.dates,
+            "aliases": self.aliases,
+            "version": self.version,
+        }
+
+    def current(self):
+        """False for an older layout or an index built with other aliases."""
+        hashtag_aliases.sync()
+        return self.version == INDEX_VERSION and self.aliases == hashtag_aliases.aliases
+
+    def any_of(self, tags):
+        """Message ids having at least one of the hashtags."""
+        tags = hashtag_aliases.canonical_all(tags)
+        lists = [self.postings.get(tag, []) for tag in tags]
+        result = []
+        for message_id in heapq.merge(*lists, key=self.key):
+            if not result or result[-1] != message_id:
+                result.append(message_id)
+        return result
+
+    def all_of(self, tags):
+        """Message ids having every one of the hashtags."""
+        tags = hashtag_aliases.canonical_all(tags)
+        if not tags:
+            return list(self.message_ids)
+        lists = sorted((self.postings.get(tag, []) for tag in tags), key=len)
+        result = lists[0]
+        for other in lists[1:]:
+            result = self._intersect(result, other)
+            if not result:
+                break
+        return list(result)
+
+    def advanced(self, required, optional):
+        """(ALL required) AND (ANY optional), empty groups are ignored."""
+        if not optional:
+            return self.all_of(required)
+        optional_ids = self.any_of(optional)
+        if not required:
+            return optional_ids
+        return self._intersect(optional_ids, self.all_of(required))
+
+    def query(self, text):
+        """Message ids matching a boolean query, [] if it is invalid."""
+        try:
+            query = compile_query(text or "")
+        except QuerySyntaxError:
+            return []
+        ids = evaluate_sets(
+            query.ast, lambda tag: self.postings.get(tag, ()), self.known
+        )
+        return sorted(ids, key=self.key)
+
+    def search(self, user):
+        """Message ids matching a user's hashtags and match mode."""
+        match_mode = user.get("match_mode", "any")
+        if match_mode == "query":
+            return self.query(user.get("query"))
+        if match_mode == "advanced":
+            return self.advanced(
+                user.get("required_hashtags", []), user.get("optional_hashtags", [])
+            )
+        if match_mode == "all":
+            return self.all_of(user.get("hashtags", []))
+        return self.any_of(user.get("hashtags", []))
+
+    def newest(self, user, limit, before=None, since=None):
+        """
+        Up to limit message ids matching a user, newest first: older than
+        the message id before and dated since (POSIX seconds) or later when
+        given. Only walks the posting lists as far as needed.
+        """
+        ids = self.iter_newest(user, before)
+        if since is not None:
+            ids = takewhile(lambda m: self.dates.get(m, 0) >= since, ids)
+        return list(islice(ids, limit))
+
+    def iter_newest(self, user, before=None):
+        """Lazily yield the message ids matching a user, newest first."""
+        match_mode = user.get("match_mode", "any")
+        if match_mode == "query":
+            ids = self.query(user.get("query"))
+            return reversed(ids[: self._cut(ids, before)])
+        if match_mode == "advanced":
+            required = hashtag_aliases.canonical_all(user.get("required_hashtags", []))
+            optional = hashtag_aliases.canonical_all(user.get("optional_hashtags", []))
+            if not optional:
+                return self._iter_all_of(required, before)
+            if not required:
+                return self._iter_any_of(optional, before)
+            lists = [self.postings.get(tag, []) for tag in required]
+            return (
+                message_id
+                for message_id in self._iter_any_of(optional, before)
+                if all(self._contains(lst, message_id) for lst in lists)
+            )
+        tags = hashtag_aliases.canonical_all(user.get("hashtags", []))
+        if match_mode == "all":
+            return self._iter_all_of(tags, before)
+        return self._iter_any_of(tags, before)
+
+    def _iter_any_of(self, tags, before):
+        lists = [self.postings.get(tag, []) for tag in tags]
+        last = None
+        for message_id in heapq.merge(
+            *(self._reversed(lst, before) for lst in lists),
+            key=self.key,
+            reverse=True,
+        ):
+            if message_id != last:
+                last = message_id
+                yield message_id
+
+    def _iter_all_of(self, tags, before):
+        if not tags:
+            yield from self._reversed(self.message_ids, before)
+            return
+        shortest, *others = sorted(
+            (self.postings.get(tag, []) for tag in tags), key=len
+        )
+        for message_id in self._reversed(shortest, before):
+            if all(self._contains(lst, message_id) for lst in others):
+                yield message_id
+
+    def _reversed(self, lst, before):
+        return (lst[i] for i in range(self._cut(lst, before) - 1, -1, -1))
+
+    def _cut(self, lst, before):
+        if before is None:
+            return len(lst)
+        return bisect_left(lst, self.key(before), key=self.key)
+
+    def _contains(self, lst, message_id):
+        i = bisect_left(lst, self.key(message_id), key=self.key)
+        return i < len(lst) and lst[i] == message_id
+
+    def documents(self, storage, message_ids):
+        """Fetch the posts for message ids, keeping their order."""
+        return storage.get_posts(list(message_ids))
+
+    def _insert(self, lst, message_id):
+        # Posts almost always arrive in date order
+        if not lst or self.key(lst[-1]) < self.key(message_id):
+            lst.append(message_id)
+            return
+        i = bisect_left(lst, self.key(message_id), key=self.key)
+        if i == len(lst) or lst[i] != message_id:
+            insort(lst, message_id, key=self.key)
+
+    def _discard(self, lst, message_id):
+        i = bisect_left(lst, self.key(message_id), key=self.key)
+        if i < len(lst) and lst[i] == message_id:
+            del lst[i]
+
+    def _intersect(self, a, b):
+        """Intersect two sorted lists by galloping through the longer one."""
+        if len(a) > len(b):
+            a, b = b, a
+        result = []
+        lo = 0
+        for message_id in a:
+            lo = bisect_left(b, self.key(message_id), lo, key=self.key)
+            if lo == len(b):
+                break
+            if b[lo] == message_id:
+                result.append(message_id)
+        return result
+
+
+post_index = PostIndex("data_json/post_index.json")
@@ -0,0 +1,122 @@
+"""
+Parser for channel posts.
+
+A post looks like:
+
+    **Xodim kerak:**                       <- title ("needs")
+
+    🏢 Idora: Tech Company                  <- body ("text"), "Label: value"
+    💰 Maosh: 1000$                            lines also end up in "fields"
+
+    #xodim #python #toshkent                <- hashtag lines
+
+    👉 [@UstozShogird kanaliga ulanish](…)  <- footer ("url")
+
+parse_post walks the lines once and returns the same keys to_json used to
+build from text.split("\\n\\n"), with canonical hashtags (core.hashtags).
+Posts it cannot use raise PostParseError with the reason.
+"""
+
+import re
+
+from core.hashtags import hashtag_aliases
+
+HASHTAG_RE = re.compile(r"#[^\s#]+")
+# A word made of hashtags only, "#a#b" included
+HASHTAG_WORD_RE = re.compile(r"(?:#[^\s#]+)+")
+MAX_LABEL_LENGTH = 41
+
+
+class PostParseError(ValueError):
+    """A post without the parts the bot needs."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def parse_post(text):
+    """
+    Split a post into needs, text, fields, hashtags and url in one pass.
+
+    Raises PostParseError when the post has no title, body or hashtags.
+    """
+    if not text or not text.strip():
+        raise PostParseError("empty")
+
+    title = []
+    body = []
+    footer = []
+    raw_hashtags = []
+    section = title
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("#") and is_hashtag_line(stripped):
+            raw_hashtags.extend(HASHTAG_RE.findall(stripped))
+            section = footer
+        elif section is title:
+            if stripped:
+                title.append(line)
+            elif title:
+                section = body
+        elif stripped or section:
+            section.append(line)
+
+    if not title:
+        raise PostParseError("no title")
+    body_text = "\n".join(body).strip("\n")
+    if not body_text:
+        raise PostParseError("no body")
+    # One alias check for the whole post
+    hashtags = hashtag_aliases.canonical_all(raw_hashtags)
+    if not hashtags:
+        raise PostParseError("no hashtags")
+
+    return {
+        "needs": "\n".join(title),
+        "text": body_text,
+        "fields": parse_fields(body),
+        "hashtags": hashtags,
+        "url": "\n".join(footer).strip("\n"),
+    }
+
+
+def is_hashtag_line(stripped):
+    """
+    Whether every word of the line is a hashtag, so "#1 priority item" in the
+    body is text and not the start of the hashtag footer.
+    """
+    return all(HASHTAG_WORD_RE.fullmatch(word) for word in stripped.split())
+
+
+def parse_fields(lines):
+    """
+    "Label: value" lines as {label: value}, the first value of a label wins.
+
+    The label starts at the first letter or digit (after emoji and markup),
+    ends at the first colon that does not start a URL and is at most
+    MAX_LABEL_LENGTH characters long.
+    """
+    fields = {}
+    for line in lines:
+        if ":" not in line:
+            continue
+        for start, char in enumerate(line):
+            if char.isalnum():
+                break
+        else:
+            continue
+        label, colon, value = line[start:].partition(":")
+        label = label.rstrip()
+        if not colon or len(label) > MAX_LABEL_LENGTH or value.startswith("//"):
+            continue
+        # Labels are often bold: **Idora:** value or **Idora**: value
+        label = label.rstrip("*_ ")
+        value = value.strip().lstrip("*_ ")
+        if value:
+            fields.setdefault(label, value)
+    return fields
+
+
+# Parser of each channel format, by the name used in the channel registry
+PARSERS = {"ustoz_shogird": parse_post}
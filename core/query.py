@@ -0,0 +1,199 @@
+"""
+Boolean hashtag queries.
+
+    #python AND (#django OR #flask) AND NOT #senior
+
+Grammar, operators are case-insensitive and adjacent terms are ANDed:
+
+    or     := and (OR and)*
+    and    := unary ([AND] unary)*
+    unary  := NOT unary | "(" or ")" | #hashtag
+
+"&", "|" and "!" or "-" can be used instead of AND, OR and NOT.
+
+A query is parsed into a small AST of tuples with canonical hashtags,
+("tag", "#python"), ("not", node), ("and", nodes), ("or", nodes), and
+compiled into a predicate over the post bitmasks of core.matcher. Compiled
+queries are cached by their text.
+"""
+
+import re
+from functools import lru_cache
+
+from core.hashtags import hashtag_aliases, hashtag_ids
+
+TOKEN_RE = re.compile(
+    r"\s*(?:(?P<lparen>\()|(?P<rparen>\))"
+    r"|(?P<and>&&?|\bAND\b)|(?P<or>\|\|?|\bOR\b)|(?P<not>!|-|\bNOT\b)"
+    r"|(?P<tag>#[^\s()#&|!]+)|(?P<bad>\S+))",
+    re.I,
+)
+MAX_QUERY_LENGTH = 500
+
+
+class QuerySyntaxError(ValueError):
+    """A query that cannot be parsed."""
+
+
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind is None:
+            continue
+        if kind == "bad":
+            raise QuerySyntaxError(f"Unexpected {match.group(kind)!r}")
+        tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("Empty query")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"Unexpected {self.take()[1]!r}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == "or":
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", tuple(nodes))
+
+    def parse_and(self):
+        nodes = [self.parse_unary()]
+        while self.peek() in ("and", "not", "lparen", "tag"):
+            if self.peek() == "and":
+                self.take()
+            nodes.append(self.parse_unary())
+        return nodes[0] if len(nodes) == 1 else ("and", tuple(nodes))
+
+    def parse_unary(self):
+        kind = self.peek()
+        if kind is None:
+            raise QuerySyntaxError("Query ends too early")
+        if kind == "not":
+            self.take()
+            return ("not", self.parse_unary())
+        if kind == "lparen":
+            self.take()
+            node = self.parse_or()
+            if self.peek() != "rparen":
+                raise QuerySyntaxError("Missing )")
+            self.take()
+            return node
+        if kind == "tag":
+            tag = hashtag_aliases.canonical(self.take()[1])
+            if tag is None:
+                raise QuerySyntaxError("Empty hashtag")
+            return ("tag", tag)
+        raise QuerySyntaxError(f"Unexpected {self.take()[1]!r}")
+
+
+def parse_query(text):
+    """The AST of a query, raises QuerySyntaxError."""
+    if len(text) > MAX_QUERY_LENGTH:
+        raise QuerySyntaxError("Query is too long")
+    return _Parser(tokenize(text)).parse()
+
+
+def query_tags(node):
+    """Every hashtag a query mentions."""
+    if node[0] == "tag":
+        return {node[1]}
+    if node[0] == "not":
+        return query_tags(node[1])
+    return set().union(*(query_tags(child) for child in node[1]))
+
+
+def format_query(node, parent=None):
+    """The query text of an AST, with canonical hashtags."""
+    kind = node[0]
+    if kind == "tag":
+        return node[1]
+    if kind == "not":
+        return f"NOT {format_query(node[1], 'not')}"
+    text = f" {kind.upper()} ".join(format_query(child, kind) for child in node[1])
+    return f"({text})" if parent is not None else text
+
+
+def _predicate(node):
+    """Compile an AST into a function of a post bitmask."""
+    kind = node[0]
+    if kind == "tag":
+        bit = 1 << hashtag_ids.intern(node[1])
+        return lambda mask: bool(mask & bit)
+    if kind == "not":
+        inner = _predicate(node[1])
+        return lambda mask: not inner(mask)
+
+    children = node[1]
+    if all(child[0] == "tag" for child in children):
+        # Plain groups of hashtags are a single mask test
+        group = 0
+        for child in children:
+            group |= 1 << hashtag_ids.intern(child[1])
+        if kind == "and":
+            return lambda mask: mask & group == group
+        return lambda mask: bool(mask & group)
+    predicates = [_predicate(child) for child in children]
+    if kind == "and":
+        return lambda mask: all(p(mask) for p in predicates)
+    return lambda mask: any(p(mask) for p in predicates)
+
+
+class CompiledQuery:
+    """A parsed query with its predicate and the mask of its hashtags."""
+
+    __slots__ = ("text", "ast", "predicate", "mask", "matches_empty")
+
+    def __init__(self, text, ast):
+        self.text = text
+        self.ast = ast
+        self.predicate = _predicate(ast)
+        self.mask = 0
+        for tag in query_tags(ast):
+            self.mask |= 1 << hashtag_ids.intern(tag)
+        # Only queries matching a post without any of their hashtags (like
+        # NOT #x) have to be evaluated for posts that share none of them
+        self.matches_empty = self.predicate(0)
+
+
+@lru_cache(maxsize=4096)
+def _compile(text, aliases_version):
+    return CompiledQuery(text, parse_query(text))
+
+
+def compile_query(text):
+    """Parse and compile a query, cached until the hashtag aliases change."""
+    return _compile(text.strip(), hashtag_aliases.sync())
+
+
+def evaluate_sets(node, lookup, universe):
+    """Evaluate a query over sets: lookup(tag) -> ids having the hashtag."""
+    kind = node[0]
+    if kind == "tag":
+        return set(lookup(node[1]))
+    if kind == "not":
+        return universe - evaluate_sets(node[1], lookup, universe)
+    results = [evaluate_sets(child, lookup, universe) for child in node[1]]
+    if kind == "and":
+        return set.intersection(*results)
+    return set.union(*results)
@@ -0,0 +1,62 @@
+"""
+Render cache for outgoing posts.
+
+A post fanned out to thousands of users is rendered once: the Telegram
+HTML is kept in an LRU keyed by (message_id, edit_date), so an edited post
+is rendered again.
+"""
+
+import threading
+from collections import OrderedDict
+
+import telegram
+
+from core.getting_data import render_post
+
+CACHE_SIZE = 1024
+
+
+class RenderedPost:
+    """Text of one message and the parse mode to send it with."""
+
+    __slots__ = ("text", "parse_mode")
+
+    def __init__(self, text, parse_mode=telegram.constants.ParseMode.HTML):
+        self.text = text
+        self.parse_mode = parse_mode
+
+
+class RenderCache:
+    """LRU of RenderedPost keyed by (message_id, edit_date)."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, post):
+        message_id = post.get("message_id")
+        if message_id is None:
+            return RenderedPost(render_post(post))
+
+        key = (message_id, post.get("edit_date"))
+        with self.lock:
+            rendered = self.entries.get(key)
+            if rendered is not None:
+                self.entries.move_to_end(key)
+                return rendered
+
+        rendered = RenderedPost(render_post(post))
+        with self.lock:
+            rendered = self.entries.setdefault(key, rendered)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return rendered
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+render_cache = RenderCache()
@@ -0,0 +1,289 @@
+"""
+Process-wide repository for the user, data, hashtag, stats and outbox tables.
+
+The bot handlers, the listener and the sender all share one Repository, so
+writes go through a single lock before reaching storage. On TinyDB the user,
+data and hashtag tables are kept in memory and loaded again once their file
+changed on disk, as the cron jobs and the scraper write them from other
+processes. On SQLite every read goes to the database.
+"""
+
+import threading
+
+from core.storage import Storage, get_storage
+
+
+class Repository(Storage):
+    """Caching, write-serializing front of a storage backend."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.lock = threading.RLock()
+        # SQLite answers lookups from its indexes, only TinyDB tables are cached
+        self.caching = storage.cache_tables
+        self._versions = {}
+        self._users = None
+        self._posts = None
+        self._posts_by_id = None
+        self._hashtags = None
+
+    def version(self, table):
+        with self.lock:
+            return self.storage.version(table)
+
+    def _stale(self, table, cached):
+        """Whether a cached table is missing or was written by another process."""
+        version = self.storage.version(table)
+        if cached is None or version != self._versions.get(table):
+            self._versions[table] = version
+            return True
+        return False
+
+    def _written(self, table):
+        # Our own write changed the version, the cache already has it
+        self._versions[table] = self.storage.version(table)
+
+    # user table
+    def _load_users(self):
+        with self.lock:
+            if self._stale("users", self._users):
+                self._users = {
+                    user["id"]: dict(user) for user in self.storage.all_users()
+                }
+            return self._users
+
+    def get_user(self, user_id):
+        if not self.caching:
+            with self.lock:
+                return self.storage.get_user(user_id)
+        return self._load_users().get(user_id)
+
+    def all_users(self):
+        if not self.caching:
+            with self.lock:
+                return self.storage.all_users()
+        return list(self._load_users().values())
+
+    def insert_user(self, user):
+        with self.lock:
+            if not self.caching:
+                return self.storage.insert_user(user)
+            users = self._load_users()
+            self.storage.insert_user(user)
+            users[user["id"]] = dict(user)
+            self._written("users")
+
+    def update_user(self, user_id, fields):
+        with self.lock:
+            if not self.caching:
+                return self.storage.update_user(user_id, fields)
+            users = self._load_users()
+            self.storage.update_user(user_id, fields)
+            user = users.get(user_id)
+            if user is not None:
+                user.update(fields)
+            self._written("users")
+
+    # data table
+    def _load_posts(self):
+        with self.lock:
+            if self._stale("posts", self._posts):
+                posts = [dict(post) for post in self.storage.all_posts()]
+                self._posts_by_id = {
+                    post["message_id"]: post
+                    for post in posts
+                    if post.get("message_id") is not None
+                }
+                self._posts = posts
+            return self._posts
+
+    def _cache_post(self, post):
+        post = dict(post)
+        stored = self._posts_by_id.get(post.get("message_id"))
+        if stored is not None:
+            # Replaced in place, so all_posts keeps the original order
+            stored.clear()
+            stored.update(post)
+            return
+        self._posts.append(post)
+        if post.get("message_id") is not None:
+            self._posts_by_id[post["message_id"]] = post
+
+    def insert_post(self, post):
+        with self.lock:
+            if not self.caching:
+                return self.storage.insert_post(post)
+            self._load_posts()
+            self.storage.insert_post(post)
+            self._cache_post(post)
+            self._written("posts")
+
+    def insert_posts(self, posts, checkpoint=None):
+        with self.lock:
+            if not self.caching:
+                return self.storage.insert_posts(posts, checkpoint)
+            self._load_posts()
+            self.storage.insert_posts(posts, checkpoint)
+            for post in posts:
+                self._cache_post(post)
+            self._written("posts")
+
+    def delete_posts(self, message_ids):
+        with self.lock:
+            if not self.caching:
+                return self.storage.delete_posts(message_ids)
+            self._load_posts()
+            self.storage.delete_posts(message_ids)
+            removed = {
+                m for m in message_ids if self._posts_by_id.pop(m, None) is not None
+            }
+            if removed:
+                self._posts = [
+                    p for p in self._posts if p.get("message_id") not in removed
+                ]
+            self._written("posts")
+
+    def get_post(self, message_id):
+        if not self.caching:
+            with self.lock:
+                return self.storage.get_post(message_id)
+        with self.lock:
+            self._load_posts()
+            return self._posts_by_id.get(message_id)
+
+    def get_posts(self, message_ids):
+        if not self.caching:
+            with self.lock:
+                return self.storage.get_posts(message_ids)
+        with self.lock:
+            self._load_posts()
+            return [self._posts_by_id[m] for m in message_ids if m in self._posts_by_id]
+
+    def all_posts(self):
+        if not self.caching:
+            with self.lock:
+                return self.storage.all_posts()
+        return list(self._load_posts())
+
+    def update_post(self, message_id, fields):
+        with self.lock:
+            if not self.caching:
+                return self.storage.update_post(message_id, fields)
+            self._load_posts()
+            self.storage.update_post(message_id, fields)
+            post = self._posts_by_id.get(message_id)
+            if post is not None:
+                post.update(fields)
+            self._written("posts")
+
+    def update_posts(self, updates, stats=()):
+        with self.lock:
+            if not self.caching:
+                return self.storage.update_posts(updates, stats)
+            self._load_posts()
+            self.storage.update_posts(updates, stats)
+            for message_id, fields in updates.items():
+                post = self._posts_by_id.get(message_id)
+                if post is not None:
+                    post.update(fields)
+            self._written("posts")
+
+    def truncate_posts(self):
+        with self.lock:
+            self.storage.truncate_posts()
+            if self.caching:
+                self._posts = []
+                self._posts_by_id = {}
+                self._written("posts")
+
+    # hashtag table
+    def _load_hashtags(self):
+        with self.lock:
+            if self._stale("hashtags", self._hashtags):
+                self._hashtags = {
+                    h["hashtag"]: h["count"] for h in self.storage.all_hashtags()
+                }
+            return self._hashtags
+
+    def all_hashtags(self):
+        if not self.caching:
+            with self.lock:
+                return self.storage.all_hashtags()
+        return [
+            {"hashtag": hashtag, "count": count}
+            for hashtag, count in self._load_hashtags().items()
+        ]
+
+    def increment_hashtag(self, hashtag, amount=1):
+        with self.lock:
+            if not self.caching:
+                return self.storage.increment_hashtag(hashtag, amount)
+            counts = self._load_hashtags()
+            self.storage.increment_hashtag(hashtag, amount)
+            counts[hashtag] = counts.get(hashtag, 0) + amount
+            self._written("hashtags")
+
+    def increment_hashtags(self, amounts):
+        with self.lock:
+            if not self.caching:
+                return self.storage.increment_hashtags(amounts)
+            counts = self._load_hashtags()
+            self.storage.increment_hashtags(amounts)
+            for hashtag, amount in amounts.items():
+                counts[hashtag] = counts.get(hashtag, 0) + amount
+            self._written("hashtags")
+
+    # stats table, write-only
+    def insert_stats(self, stats):
+        with self.lock:
+            self.storage.insert_stats(stats)
+
+    # scrape checkpoints
+    def get_checkpoint(self, name):
+        return self.storage.get_checkpoint(name)
+
+    def set_checkpoint(self, name, value):
+        with self.lock:
+            self.storage.set_checkpoint(name, value)
+
+    # outbox table, written through so a crash never loses a state change
+    def insert_outbox(self, entries):
+        with self.lock:
+            return self.storage.insert_outbox(entries)
+
+    def update_outbox(self, user_id, message_id, fields):
+        with self.lock:
+            self.storage.update_outbox(user_id, message_id, fields)
+
+    def outbox_entries(self, states):
+        return self.storage.outbox_entries(states)
+
+    def claim_outbox(self, user_id, message_id, owner, lease_until):
+        with self.lock:
+            return self.storage.claim_outbox(user_id, message_id, owner, lease_until)
+
+    def renew_outbox(self, owner, lease_until):
+        with self.lock:
+            self.storage.renew_outbox(owner, lease_until)
+
+    def release_outbox(self, now):
+        with self.lock:
+            return self.storage.release_outbox(now)
+
+    def close(self):
+        with self.lock:
+            self.storage.close()
+
+
+_repository = None
+_repository_lock = threading.Lock()
+
+
+def get_repository():
+    """Return the process-wide repository, opening storage on first use."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                _repository = Repository(get_storage(cached=True))
+    return _repository
@@ -0,0 +1,68 @@
+"""
+Per-user cursors over search results.
+
+A search keeps only the message ids fetched so far and the page the user
+is on; the posts themselves are loaded one page at a time when the user
+taps Next or Prev. Cursors expire after CURSOR_TTL seconds without use.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+CURSOR_TTL = 30 * 60  # seconds
+MAX_CURSORS = 10000
+
+
+class SearchCursor:
+    """Message ids fetched so far, the current position and the total wanted."""
+
+    __slots__ = ("user", "ids", "position", "limit", "exhausted", "title", "since")
+
+    def __init__(self, user, ids, limit, exhausted, title, since=None):
+        self.user = user
+        self.ids = ids
+        self.position = 0
+        self.limit = limit
+        self.exhausted = exhausted
+        self.title = title
+        self.since = since
+
+
+class SearchCursors:
+    """user id -> SearchCursor, dropped after ttl seconds without use."""
+
+    def __init__(self, ttl=CURSOR_TTL, maxsize=MAX_CURSORS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, user_id, cursor):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic(), cursor)
+            self.entries.move_to_end(user_id)
+            self._expire()
+
+    def get(self, user_id):
+        """The cursor of a user, None once it expired."""
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            self.entries[user_id] = (time.monotonic(), entry[1])
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def _expire(self):
+        # Entries are kept in last-use order, so the stale ones are first
+        now = time.monotonic()
+        while self.entries:
+            user_id, (used, _) = next(iter(self.entries.items()))
+            if now - used < self.ttl and len(self.entries) <= self.maxsize:
+                break
+            del self.entries[user_id]
+
+
+search_cursors = SearchCursors()
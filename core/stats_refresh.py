@@ -0,0 +1,126 @@
+"""
+Incremental refresh of view and forward counts.
+
+Only posts that are due are refreshed, with GetMessagesViewsRequest in
+chunks of up to 100 ids instead of a walk over the whole channel history.
+Counts move fast while a post is new and hardly at all once it is old, so
+a post is refreshed about every age / AGE_FACTOR, between MIN_INTERVAL and
+max_interval. Every chunk is written with one bulk update.
+"""
+
+import datetime
+
+from telethon.tl.functions.messages import GetMessagesViewsRequest
+
+from core.channels import channel_message_id, channels
+
+CHUNK_SIZE = 100  # ids per GetMessagesViewsRequest
+AGE_FACTOR = 10
+MIN_INTERVAL = datetime.timedelta(hours=1)
+MAX_INTERVAL = datetime.timedelta(days=30)
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def parse_date(value):
+    """Aware datetime of an ISO string, naive values are local time."""
+    if not value:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return date if date.tzinfo else date.astimezone()
+
+
+def refresh_interval(age, max_interval=MAX_INTERVAL):
+    return min(max(age / AGE_FACTOR, MIN_INTERVAL), max_interval)
+
+
+def due_posts(posts, now=None, max_interval=MAX_INTERVAL):
+    """Message ids of the posts due for a refresh, newest first."""
+    now = now or utc_now()
+    due = []
+    for post in posts:
+        message_id = post.get("message_id")
+        if message_id is None:
+            continue
+        checked = parse_date(post.get("views_checked_at") or post.get("processed_at"))
+        if checked is None:
+            due.append((now, message_id))
+            continue
+        date = parse_date(post.get("date")) or checked
+        if now - checked >= refresh_interval(now - date, max_interval):
+            due.append((date, message_id))
+    due.sort(reverse=True)
+    return [message_id for _, message_id in due]
+
+
+async def refresh_views(
+    client, channel, repository, max_interval=MAX_INTERVAL, chunk_size=CHUNK_SIZE
+):
+    """Refresh the counts of every due post of a channel, return how many changed."""
+    posts = [p for p in repository.all_posts() if channels.for_post(p) is channel]
+    message_ids = due_posts(posts, max_interval=max_interval)
+    if not message_ids:
+        print(f"📊 No posts of {channel.name} due for a statistics refresh")
+        return 0
+
+    peer = await client.get_input_entity(channel.url)
+    changed = 0
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start : start + chunk_size]
+        result = await client(
+            GetMessagesViewsRequest(
+                peer=peer, id=[channel_message_id(m) for m in chunk], increment=False
+            )
+        )
+        checked_at = utc_now().isoformat()
+        posts = {post["message_id"]: post for post in repository.get_posts(chunk)}
+        updates = {}
+        stats = []
+        for message_id, counts in zip(chunk, result.views):
+            post = posts.get(message_id)
+            if post is None:
+                continue
+            fields = {"views_checked_at": checked_at}
+            # Deleted messages come back without counts
+            if counts.views is not None:
+                views = counts.views
+                forwards = counts.forwards or 0
+                replies = counts.replies.replies if counts.replies else None
+                if (views, forwards, replies) != (
+                    post.get("views"),
+                    post.get("forwards"),
+                    post.get("replies"),
+                ):
+                    fields.update(
+                        views=views,
+                        forwards=forwards,
+                        replies=replies,
+                        last_updated=datetime.datetime.now().isoformat(),
+                    )
+                    stats.append(
+                        {
+                            "message_id": message_id,
+                            "date": post.get("date"),
+                            "text_length": post.get("text_length", 0),
+                            "has_media": post.get("media_type") is not None,
+                            "views": views,
+                            "forwards": forwards,
+                            "processed_at": fields["last_updated"],
+                            "update_type": "periodic",
+                        }
+                    )
+            updates[message_id] = fields
+        repository.update_posts(updates, stats)
+        changed += len(stats)
+        print(
+            f"🔄 Refreshed {min(start + chunk_size, len(message_ids))}"
+            f"/{len(message_ids)} due posts, {changed} changed so far..."
+        )
+
+    print(f"✅ Completed refresh: {changed}/{len(message_ids)} posts had changes")
+    return changed
@@ -0,0 +1,898 @@
+"""
+Storage backends for the user, data, hashtag and stats tables.
+
+The backend is picked with the STORAGE_BACKEND environment variable:
+"tinydb" (default) keeps the data_json/*.json files, "sqlite" stores every
+table in one SQLite database (DATABASE_PATH, WAL mode) so an insert or a
+view-count update only writes the rows it touches. The outbox changes state
+on every send, so the tinydb backend keeps it in SQLite too
+(data_json/outbox.sqlite3).
+
+Import the existing JSON files into SQLite once with:
+    python main.py migrate
+"""
+
+import json
+import os
+import sqlite3
+
+from tinydb import Query, TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+from tinydb.table import Table
+
+
+class Storage:
+    """Interface shared by every storage backend."""
+
+    # Whether a Repository may keep whole tables of this backend in memory
+    cache_tables = False
+
+    def version(self, table):
+        """
+        Token that changes whenever a table was written, by any process.
+        None when the backend cannot tell.
+        """
+        return None
+
+    # user table
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def all_users(self):
+        raise NotImplementedError
+
+    def insert_user(self, user):
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    # data table, posts are unique by message_id
+    def insert_post(self, post):
+        """Insert a post, or replace the stored post with its message_id."""
+        raise NotImplementedError
+
+    def insert_posts(self, posts, checkpoint=None):
+        """
+        Upsert a batch of posts and, with it, the {name: value} checkpoint.
+
+        Backends commit both together where they can, so a resumed scrape
+        never starts past the stored posts.
+        """
+        raise NotImplementedError
+
+    def delete_posts(self, message_ids):
+        raise NotImplementedError
+
+    def get_post(self, message_id):
+        raise NotImplementedError
+
+    def get_posts(self, message_ids):
+        """Posts for the given message ids, in the same order."""
+        raise NotImplementedError
+
+    def all_posts(self):
+        raise NotImplementedError
+
+    def update_post(self, message_id, fields):
+        raise NotImplementedError
+
+    def update_posts(self, updates, stats=()):
+        """
+        Apply {message_id: fields} to many posts and insert the stats records.
+
+        One write for the whole batch instead of one per post.
+        """
+        raise NotImplementedError
+
+    def truncate_posts(self):
+        raise NotImplementedError
+
+    # hashtag table
+    def all_hashtags(self):
+        """Every {"hashtag": ..., "count": ...} record."""
+        raise NotImplementedError
+
+    def increment_hashtag(self, hashtag, amount=1):
+        raise NotImplementedError
+
+    def increment_hashtags(self, amounts):
+        """Add {hashtag: amount} to the counts in one write."""
+        raise NotImplementedError
+
+    # stats table
+    def insert_stats(self, stats):
+        raise NotImplementedError
+
+    # scrape checkpoints
+    def get_checkpoint(self, name):
+        raise NotImplementedError
+
+    def set_checkpoint(self, name, value):
+        raise NotImplementedError
+
+    # outbox table
+    def insert_outbox(self, entries):
+        """Insert entries whose (user_id, message_id) is new, return those."""
+        raise NotImplementedError
+
+    def update_outbox(self, user_id, message_id, fields):
+        raise NotImplementedError
+
+    def outbox_entries(self, states):
+        """Outbox entries in one of the given states."""
+        raise NotImplementedError
+
+    def claim_outbox(self, user_id, message_id, owner, lease_until):
+        """Move a pending entry to queued for owner, False if it was not pending."""
+        raise NotImplementedError
+
+    def renew_outbox(self, owner, lease_until):
+        """Extend the lease of the queued and sending entries of owner."""
+        raise NotImplementedError
+
+    def release_outbox(self, now):
+        """
+        Hand back entries whose lease expired: queued ones become pending,
+        sending ones unknown. Returns both counts.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FreshCachingMiddleware(CachingMiddleware):
+    """
+    Keeps the parsed file in memory and writes through on every change, but
+    parses it again once the file changed on disk, so writes of another
+    process are neither missed on reads nor overwritten on the next write.
+    """
+
+    WRITE_CACHE_SIZE = 1
+
+    def __call__(self, path, *args, **kwargs):
+        self.path = path
+        self.stamp = None
+        return super().__call__(path, *args, **kwargs)
+
+    def read(self):
+        stamp = file_stamp(self.path)
+        if self.cache is None or stamp != self.stamp:
+            self.cache = self.storage.read()
+            self.stamp = stamp
+        return self.cache
+
+    def flush(self):
+        super().flush()
+        self.stamp = file_stamp(self.path)
+
+
+class FreshTable(Table):
+    """Table that finds the next document id again before every write."""
+
+    def _update_table(self, updater):
+        # Another process may have inserted documents since the last write
+        self._next_id = None
+        super()._update_table(updater)
+
+
+def file_stamp(path):
+    """(mtime, size) of a file, changes whenever it is rewritten."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class TinyDBStorage(Storage):
+    """
+    The original data_json/*.json files, with the outbox in outbox.sqlite3.
+
+    With cached=True each file is parsed once and kept in memory until it
+    changes on disk, every write is still flushed to disk immediately.
+    """
+
+    cache_tables = True
+
+    def __init__(self, directory="data_json", cached=False):
+        os.makedirs(directory, exist_ok=True)
+        self.cached = cached
+        self.progress_file = f"{directory}/scrape_progress.json"
+        self.userdb = self._open(
+            f"{directory}/user.json", indent=4, separators=(",", ": ")
+        )
+        self.datadb = self._open(
+            f"{directory}/data.json",
+            indent=4,
+            separators=(",", ": "),
+            encoding="utf-8",
+        )
+        self.hashdb = self._open(
+            f"{directory}/hashtag.json",
+            sort_keys=True,
+            indent=4,
+            separators=(",", ": "),
+        )
+        self.statsdb = self._open(
+            f"{directory}/statistics.json",
+            sort_keys=True,
+            indent=4,
+            separators=(",", ": "),
+        )
+        self.outbox = SQLiteOutbox(connect(f"{directory}/outbox.sqlite3"))
+        self._import_outbox(f"{directory}/outbox.json")
+        # No query cache: it would not notice writes of other processes
+        self.users = self.userdb.table("user", cache_size=0)
+        self.data = self.datadb.table("data", cache_size=0)
+        self.hashtags = self.hashdb.table("hashtag", cache_size=0)
+        self.stats = self.statsdb.table("stats", cache_size=0)
+        self.paths = {
+            "users": f"{directory}/user.json",
+            "posts": f"{directory}/data.json",
+            "hashtags": f"{directory}/hashtag.json",
+        }
+
+    def _open(self, path, **kwargs):
+        if self.cached:
+            kwargs["storage"] = FreshCachingMiddleware(JSONStorage)
+        db = TinyDB(path, **kwargs)
+        db.table_class = FreshTable
+        return db
+
+    def version(self, table):
+        return file_stamp(self.paths[table])
+
+    def get_user(self, user_id):
+        return self.users.get(Query().id == user_id)
+
+    def all_users(self):
+        return self.users.all()
+
+    def insert_user(self, user):
+        self.users.insert(user)
+
+    def update_user(self, user_id, fields):
+        self.users.update(fields, Query().id == user_id)
+
+    def insert_post(self, post):
+        self.insert_posts([post])
+
+    def insert_posts(self, posts, checkpoint=None):
+        # At most two rewrites of data.json for the whole batch: one replaces
+        # the stored posts with the same message_id, one adds the new posts
+        by_id = {p["message_id"]: p for p in posts if p.get("message_id") is not None}
+        new = [p for p in posts if p.get("message_id") is None]
+        if by_id:
+            stored = {
+                doc["message_id"]
+                for doc in self.data.search(Query().message_id.one_of(list(by_id)))
+            }
+            if stored:
+                self.data.update(
+                    lambda doc: self._replace(doc, by_id[doc["message_id"]]),
+                    Query().message_id.one_of(list(stored)),
+                )
+            new += [post for m, post in by_id.items() if m not in stored]
+        if new:
+            self.data.insert_multiple(new)
+        if checkpoint:
+            for name, value in checkpoint.items():
+                self.set_checkpoint(name, value)
+
+    def get_post(self, message_id):
+        return self.data.get(Query().message_id == message_id)
+
+    def get_posts(self, message_ids):
+        if not message_ids:
+            return []
+        found = {
+            doc["message_id"]: doc
+            for doc in self.data.search(Query().message_id.one_of(message_ids))
+        }
+        return [found[m] for m in message_ids if m in found]
+
+    def all_posts(self):
+        return self.data.all()
+
+    def update_post(self, message_id, fields):
+        self.data.update(fields, Query().message_id == message_id)
+
+    def update_posts(self, updates, stats=()):
+        # One pass over data.json and one rewrite, however many posts changed
+        if updates:
+            self.data.update(
+                lambda doc: doc.update(updates[doc["message_id"]]),
+                Query().message_id.one_of(list(updates)),
+            )
+        if stats:
+            self.stats.insert_multiple(stats)
+
+    @staticmethod
+    def _replace(doc, post):
+        doc.clear()
+        doc.update(post)
+
+    def delete_posts(self, message_ids):
+        if message_ids:
+            self.data.remove(Query().message_id.one_of(list(message_ids)))
+
+    def truncate_posts(self):
+        self.data.truncate()
+
+    def all_hashtags(self):
+        return self.hashtags.all()
+
+    def increment_hashtag(self, hashtag, amount=1):
+        Hashtag = Query()
+        dct = self.hashtags.get(Hashtag.hashtag == hashtag)
+        if not dct:
+            self.hashtags.insert({"hashtag": hashtag, "count": amount})
+        else:
+            self.hashtags.update(
+                {"count": dct["count"] + amount}, Hashtag.hashtag == hashtag
+            )
+
+    def increment_hashtags(self, amounts):
+        Hashtag = Query()
+        existing = {
+            h["hashtag"]
+            for h in self.hashtags.search(Hashtag.hashtag.one_of(list(amounts)))
+        }
+        if existing:
+            self.hashtags.update(
+                lambda doc: doc.update(count=doc["count"] + amounts[doc["hashtag"]]),
+                Hashtag.hashtag.one_of(list(existing)),
+            )
+        new = [
+            {"hashtag": hashtag, "count": amount}
+            for hashtag, amount in amounts.items()
+            if hashtag not in existing
+        ]
+        if new:
+            self.hashtags.insert_multiple(new)
+
+    def insert_stats(self, stats):
+        self.stats.insert(stats)
+
+    def _read_progress(self):
+        if not os.path.exists(self.progress_file):
+            return {}
+        with open(self.progress_file, "r") as f:
+            try:
+                return json.load(f)
+            except Exception:
+                return {}
+
+    def get_checkpoint(self, name):
+        return self._read_progress().get(name)
+
+    def set_checkpoint(self, name, value):
+        progress = self._read_progress()
+        progress[name] = value
+        # Replace the file atomically so a crash never leaves half a JSON
+        tmp_path = f"{self.progress_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, self.progress_file)
+
+    def _import_outbox(self, path):
+        """Move the entries of the former outbox.json into outbox.sqlite3."""
+        if not os.path.exists(path):
+            return
+        db = TinyDB(path)
+        self.outbox.insert(db.table("outbox").all())
+        db.close()
+        try:
+            os.replace(path, f"{path}.imported")
+        except FileNotFoundError:
+            # Imported by another process at the same time
+            pass
+
+    def insert_outbox(self, entries):
+        return self.outbox.insert(entries)
+
+    def update_outbox(self, user_id, message_id, fields):
+        self.outbox.update(user_id, message_id, fields)
+
+    def outbox_entries(self, states):
+        return self.outbox.entries(states)
+
+    def claim_outbox(self, user_id, message_id, owner, lease_until):
+        return self.outbox.claim(user_id, message_id, owner, lease_until)
+
+    def renew_outbox(self, owner, lease_until):
+        self.outbox.renew(owner, lease_until)
+
+    def release_outbox(self, now):
+        return self.outbox.release(now)
+
+    def close(self):
+        for db in (self.userdb, self.datadb, self.hashdb, self.statsdb):
+            db.close()
+        self.outbox.conn.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS post_hashtags (
+    hashtag TEXT NOT NULL,
+    message_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_post_hashtags_hashtag
+    ON post_hashtags (hashtag, message_id);
+CREATE INDEX IF NOT EXISTS idx_post_hashtags_message_id
+    ON post_hashtags (message_id);
+CREATE TABLE IF NOT EXISTS hashtags (
+    hashtag TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stats_message_id ON stats (message_id);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+# Tables whose writes bump table_versions, so other processes notice them
+VERSIONED_TABLES = ("users", "posts", "hashtags")
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    user_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TEXT,
+    sent_at TEXT,
+    owner TEXT,
+    lease_until TEXT,
+    PRIMARY KEY (user_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_state ON outbox (state, next_attempt_at);
+"""
+OUTBOX_COLUMNS = (
+    "user_id",
+    "message_id",
+    "state",
+    "attempts",
+    "next_attempt_at",
+    "sent_at",
+    "owner",
+    "lease_until",
+)
+
+
+def connect(path):
+    """Open a SQLite database in WAL mode, creating its directory."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteOutbox:
+    """
+    The outbox table, one row per (user_id, message_id) so a state change
+    only writes its own row.
+
+    Several processes share the table: a process only sends the entries it
+    claimed, and keeps them under a lease (owner, lease_until) that the
+    others respect until it expires.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.executescript(OUTBOX_SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        # Tables created before leases
+        for column in ("owner", "lease_until"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+        self.conn.commit()
+
+    def insert(self, entries):
+        """Insert the entries whose key is new, return those."""
+        new_entries = []
+        with self.conn:
+            for entry in entries:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO outbox "
+                    f"({', '.join(OUTBOX_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        entry["user_id"],
+                        entry["message_id"],
+                        entry["state"],
+                        entry.get("attempts", 0),
+                        entry.get("next_attempt_at"),
+                        entry.get("sent_at"),
+                        entry.get("owner"),
+                        entry.get("lease_until"),
+                    ),
+                )
+                if cursor.rowcount:
+                    new_entries.append(entry)
+        return new_entries
+
+    def update(self, user_id, message_id, fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE outbox SET {columns} WHERE user_id = ? AND message_id = ?",
+                (*fields.values(), user_id, message_id),
+            )
+
+    def entries(self, states):
+        states = list(states)
+        placeholders = ",".join("?" * len(states))
+        rows = self.conn.execute(
+            f"SELECT {', '.join(OUTBOX_COLUMNS)} "
+            f"FROM outbox WHERE state IN ({placeholders})",
+            states,
+        )
+        return [dict(zip(OUTBOX_COLUMNS, row)) for row in rows]
+
+    def all(self):
+        rows = self.conn.execute(f"SELECT {', '.join(OUTBOX_COLUMNS)} FROM outbox")
+        return [dict(zip(OUTBOX_COLUMNS, row)) for row in rows]
+
+    def claim(self, user_id, message_id, owner, lease_until):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE outbox SET state = 'queued', owner = ?, lease_until = ? "
+                "WHERE user_id = ? AND message_id = ? AND state = 'pending'",
+                (owner, lease_until, user_id, message_id),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, owner, lease_until):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET lease_until = ? "
+                "WHERE owner = ? AND state IN ('queued', 'sending')",
+                (lease_until, owner),
+            )
+
+    def release(self, now):
+        expired = "(lease_until IS NULL OR lease_until < ?)"
+        with self.conn:
+            # Never handed to Telegram, safe to send again
+            queued = self.conn.execute(
+                "UPDATE outbox SET state = 'pending', owner = NULL "
+                f"WHERE state = 'queued' AND {expired}",
+                (now,),
+            ).rowcount
+            # May or may not have reached the user
+            sending = self.conn.execute(
+                f"UPDATE outbox SET state = 'unknown' WHERE state = 'sending' AND {expired}",
+                (now,),
+            ).rowcount
+        return queued, sending
+
+
+class SQLiteStorage(Storage):
+    """All tables in one SQLite database with per-row writes."""
+
+    def __init__(self, path="data_json/bot.sqlite3"):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(SCHEMA)
+        self._ensure_version_triggers()
+        self.conn.commit()
+        self.outbox = SQLiteOutbox(self.conn)
+        self._ensure_unique_posts()
+
+    def _ensure_version_triggers(self):
+        for table in VERSIONED_TABLES:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,)
+            )
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                self.conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} "
+                    f"AFTER {event} ON {table} BEGIN "
+                    "UPDATE table_versions SET version = version + 1 "
+                    f"WHERE name = '{table}'; END"
+                )
+
+    def version(self, table):
+        row = self.conn.execute(
+            "SELECT version FROM table_versions WHERE name = ?", (table,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _ensure_unique_posts(self):
+        """Make message_id unique, keeping the newest copy of duplicates."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+            ("idx_posts_message_id_unique",),
+        ).fetchone()
+        if exists:
+            return
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM posts WHERE message_id IS NOT NULL AND id NOT IN "
+                "(SELECT MAX(id) FROM posts GROUP BY message_id)"
+            )
+            self.conn.execute(
+                "DELETE FROM post_hashtags WHERE rowid NOT IN "
+                "(SELECT MIN(rowid) FROM post_hashtags GROUP BY hashtag, message_id)"
+            )
+            self.conn.execute("DROP INDEX IF EXISTS idx_posts_message_id")
+            self.conn.execute(
+                "CREATE UNIQUE INDEX idx_posts_message_id_unique ON posts (message_id)"
+            )
+
+    def get_user(self, user_id):
+        row = self.conn.execute(
+            "SELECT doc FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all_users(self):
+        rows = self.conn.execute("SELECT doc FROM users ORDER BY id")
+        return [json.loads(row[0]) for row in rows]
+
+    def insert_user(self, user):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users (id, doc) VALUES (?, ?)",
+                (user["id"], json.dumps(user, ensure_ascii=False)),
+            )
+
+    def update_user(self, user_id, fields):
+        with self.conn:
+            user = self.get_user(user_id)
+            if user is None:
+                return
+            user.update(fields)
+            self.conn.execute(
+                "UPDATE users SET doc = ? WHERE id = ?",
+                (json.dumps(user, ensure_ascii=False), user_id),
+            )
+
+    def insert_post(self, post):
+        with self.conn:
+            self._insert_post(post)
+
+    def _insert_post(self, post):
+        message_id = post.get("message_id")
+        # The unique index turns a repeated message_id into an update
+        self.conn.execute(
+            "INSERT INTO posts (message_id, doc) VALUES (?, ?) "
+            "ON CONFLICT(message_id) DO UPDATE SET doc = excluded.doc",
+            (message_id, json.dumps(post, ensure_ascii=False)),
+        )
+        if message_id is not None:
+            self.conn.execute(
+                "DELETE FROM post_hashtags WHERE message_id = ?", (message_id,)
+            )
+            self.conn.executemany(
+                "INSERT INTO post_hashtags (hashtag, message_id) VALUES (?, ?)",
+                [(tag, message_id) for tag in set(post.get("hashtags", []))],
+            )
+
+    def insert_posts(self, posts, checkpoint=None):
+        # The batch and its checkpoint commit in the same transaction
+        with self.conn:
+            for post in posts:
+                self._insert_post(post)
+            for name, value in (checkpoint or {}).items():
+                self._set_checkpoint(name, value)
+
+    def get_post(self, message_id):
+        row = self.conn.execute(
+            "SELECT doc FROM posts WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_posts(self, message_ids):
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for i in range(0, len(message_ids), 500):
+            chunk = message_ids[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT message_id, doc FROM posts WHERE message_id IN ({placeholders})",
+                chunk,
+            )
+            for message_id, doc in rows:
+                found[message_id] = json.loads(doc)
+        return [found[m] for m in message_ids if m in found]
+
+    def all_posts(self):
+        rows = self.conn.execute("SELECT doc FROM posts ORDER BY id")
+        return [json.loads(row[0]) for row in rows]
+
+    def update_post(self, message_id, fields):
+        with self.conn:
+            post = self.get_post(message_id)
+            if post is None:
+                return
+            post.update(fields)
+            self.conn.execute(
+                "UPDATE posts SET doc = ? WHERE message_id = ?",
+                (json.dumps(post, ensure_ascii=False), message_id),
+            )
+
+    def update_posts(self, updates, stats=()):
+        with self.conn:
+            posts = self.get_posts(list(updates))
+            for post in posts:
+                post.update(updates[post["message_id"]])
+            self.conn.executemany(
+                "UPDATE posts SET doc = ? WHERE message_id = ?",
+                [
+                    (json.dumps(post, ensure_ascii=False), post["message_id"])
+                    for post in posts
+                ],
+            )
+            self.conn.executemany(
+                "INSERT INTO stats (message_id, doc) VALUES (?, ?)",
+                [
+                    (s.get("message_id"), json.dumps(s, ensure_ascii=False))
+                    for s in stats
+                ],
+            )
+
+    def delete_posts(self, message_ids):
+        with self.conn:
+            for message_id in message_ids:
+                self.conn.execute(
+                    "DELETE FROM posts WHERE message_id = ?", (message_id,)
+                )
+                self.conn.execute(
+                    "DELETE FROM post_hashtags WHERE message_id = ?", (message_id,)
+                )
+
+    def truncate_posts(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM posts")
+            self.conn.execute("DELETE FROM post_hashtags")
+
+    def all_hashtags(self):
+        rows = self.conn.execute("SELECT hashtag, count FROM hashtags")
+        return [{"hashtag": hashtag, "count": count} for hashtag, count in rows]
+
+    def increment_hashtag(self, hashtag, amount=1):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO hashtags (hashtag, count) VALUES (?, ?) "
+                "ON CONFLICT(hashtag) DO UPDATE SET count = count + excluded.count",
+                (hashtag, amount),
+            )
+
+    def increment_hashtags(self, amounts):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO hashtags (hashtag, count) VALUES (?, ?) "
+                "ON CONFLICT(hashtag) DO UPDATE SET count = count + excluded.count",
+                list(amounts.items()),
+            )
+
+    def insert_stats(self, stats):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO stats (message_id, doc) VALUES (?, ?)",
+                (stats.get("message_id"), json.dumps(stats, ensure_ascii=False)),
+            )
+
+    def get_checkpoint(self, name):
+        row = self.conn.execute(
+            "SELECT value FROM checkpoints WHERE name = ?", (name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_checkpoint(self, name, value):
+        with self.conn:
+            self._set_checkpoint(name, value)
+
+    def _set_checkpoint(self, name, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)",
+            (name, json.dumps(value)),
+        )
+
+    def insert_outbox(self, entries):
+        return self.outbox.insert(entries)
+
+    def update_outbox(self, user_id, message_id, fields):
+        self.outbox.update(user_id, message_id, fields)
+
+    def outbox_entries(self, states):
+        return self.outbox.entries(states)
+
+    def claim_outbox(self, user_id, message_id, owner, lease_until):
+        return self.outbox.claim(user_id, message_id, owner, lease_until)
+
+    def renew_outbox(self, owner, lease_until):
+        self.outbox.renew(owner, lease_until)
+
+    def release_outbox(self, now):
+        return self.outbox.release(now)
+
+    def close(self):
+        self.conn.close()
+
+
+def get_storage(cached=False):
+    """Open the storage backend selected by STORAGE_BACKEND."""
+    backend = os.getenv("STORAGE_BACKEND", "tinydb").lower()
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("DATABASE_PATH", "data_json/bot.sqlite3"))
+    if backend == "tinydb":
+        return TinyDBStorage(cached=cached)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def migrate_json_to_sqlite(directory="data_json", path=None):
+    """Import the TinyDB JSON files into a SQLite database in one pass."""
+    path = path or os.getenv("DATABASE_PATH", f"{directory}/bot.sqlite3")
+    source = TinyDBStorage(directory)
+    target = SQLiteStorage(path)
+
+    users = source.all_users()
+    posts = source.all_posts()
+    hashtags = source.all_hashtags()
+    stats = source.stats.all()
+    outbox = source.outbox.all()
+    progress = source._read_progress()
+
+    with target.conn:
+        for table in (
+            "users",
+            "posts",
+            "post_hashtags",
+            "hashtags",
+            "stats",
+            "outbox",
+            "checkpoints",
+        ):
+            target.conn.execute(f"DELETE FROM {table}")
+        target.conn.executemany(
+            "INSERT OR REPLACE INTO users (id, doc) VALUES (?, ?)",
+            [(u["id"], json.dumps(u, ensure_ascii=False)) for u in users],
+        )
+        for post in posts:
+            target._insert_post(post)
+        target.conn.executemany(
+            "INSERT OR REPLACE INTO hashtags (hashtag, count) VALUES (?, ?)",
+            [(h["hashtag"], h.get("count", 0)) for h in hashtags],
+        )
+        target.conn.executemany(
+            "INSERT INTO stats (message_id, doc) VALUES (?, ?)",
+            [(s.get("message_id"), json.dumps(s, ensure_ascii=False)) for s in stats],
+        )
+
+    for name, value in progress.items():
+        target.set_checkpoint(name, value)
+    target.insert_outbox(outbox)
+
+    source.close()
+    target.close()
+    print(
+        f"Migrated {len(users)} users, {len(posts)} posts, "
+        f"{len(hashtags)} hashtags, {len(stats)} stats records and "
+        f"{len(outbox)} outbox entries to {path}"
+    )
@@ -0,0 +1,137 @@
+"""
+In-memory inverted index of hashtag -> subscribed user ids.
+
+Used by the real-time fan-out so that a new post only touches the users that
+subscribed to one of its hashtags instead of every user in the table.
+Hashtags are canonicalised and interned, so postings are keyed by ints, and
+the candidates are checked with the bitmasks of core.matcher.
+"""
+
+from collections import defaultdict
+
+from core.hashtags import hashtag_aliases
+from core.matcher import (
+    ADVANCED,
+    QUERY,
+    VectorMatcher,
+    compile_subscription,
+    hashtag_mask,
+    mask_ids,
+    np,
+)
+
+# Above this share of candidates, match every user at once with NumPy
+VECTORIZE_RATIO = 0.25
+VECTORIZE_MIN_USERS = 1000
+
+
+class SubscriptionIndex:
+    """Hashtag id -> user id postings over compiled subscriptions."""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        # Advanced users without required/optional groups and queries like
+        # NOT #x match posts without any of their hashtags
+        self.match_everything = set()
+        self.query_users = set()
+        # user id -> core.matcher.Subscription
+        self.users = {}
+        self.vector_matcher = None
+        self.built = False
+        self.aliases_version = None
+        self.users_version = None
+
+    def build(self, users, users_version=None):
+        """
+        Rebuild the whole index from a list of user records, read at
+        users_version of the user table.
+        """
+        self.__init__()
+        self.aliases_version = hashtag_aliases.sync()
+        self.users_version = users_version
+        for user in users:
+            self.update_user(user)
+        self.built = True
+
+    def stale(self, users_version=None):
+        """
+        True until built, and again once the alias table or the user table
+        changed, e.g. when the bot runs in another process than the listener.
+        """
+        return (
+            not self.built
+            or self.aliases_version != hashtag_aliases.sync()
+            or self.users_version != users_version
+        )
+
+    def remove_user(self, user_id):
+        """Drop every posting of a user."""
+        subscription = self.users.pop(user_id, None)
+        if subscription is None:
+            return
+        self.vector_matcher = None
+        self.match_everything.discard(user_id)
+        self.query_users.discard(user_id)
+        for tag_id in mask_ids(self._posted_mask(subscription)):
+            users = self.postings.get(tag_id)
+            if users is None:
+                continue
+            users.discard(user_id)
+            if not users:
+                del self.postings[tag_id]
+
+    def update_user(self, user):
+        """(Re)index a single user record after its subscription changed."""
+        if not user:
+            return
+        self.remove_user(user["id"])
+        subscription = compile_subscription(user)
+        if subscription is None:
+            return
+        self.users[subscription.user_id] = subscription
+        self.vector_matcher = None
+
+        posted = self._posted_mask(subscription)
+        if subscription.mode == QUERY:
+            self.query_users.add(subscription.user_id)
+        if not posted or (
+            subscription.mode == QUERY and subscription.query.matches_empty
+        ):
+            self.match_everything.add(subscription.user_id)
+        for tag_id in mask_ids(posted):
+            self.postings[tag_id].add(subscription.user_id)
+
+    def match(self, message_hashtags):
+        """Return the ids of users whose subscription matches the hashtags."""
+        post_mask = hashtag_mask(message_hashtags)
+        candidates = set(self.match_everything)
+        for tag_id in mask_ids(post_mask):
+            candidates.update(self.postings.get(tag_id, ()))
+
+        if (
+            np is not None
+            and len(self.users) >= VECTORIZE_MIN_USERS
+            and len(candidates) >= VECTORIZE_RATIO * len(self.users)
+        ):
+            if self.vector_matcher is None:
+                self.vector_matcher = VectorMatcher(self.users.values())
+            matched = self.vector_matcher.match(post_mask)
+            candidates &= self.query_users
+        else:
+            matched = set()
+
+        matched.update(
+            user_id for user_id in candidates if self.users[user_id].matches(post_mask)
+        )
+        return matched
+
+    @staticmethod
+    def _posted_mask(subscription):
+        # A post can only match through the hashtags the mode looks at
+        if subscription.mode == ADVANCED:
+            return subscription.required | subscription.optional
+        return subscription.mask
+
+
+# Process-wide index shared by the bot handlers and the listener
+subscription_index = SubscriptionIndex()
@@ -0,0 +1,148 @@
+"""
+Persistent full-text index over post bodies, ranked with BM25.
+
+Every post's title, body and hashtags are tokenised into casefolded words;
+the index keeps term -> {message_id: term frequency} postings and the
+length of every document, so a text query only reads the postings of its
+own words instead of scanning every text field of data.json.
+
+Like the hashtag post index it is saved next to the data files and built
+incrementally by the listener and scrape_all; changes between two full saves
+go to an append-only log (core.index_log).
+"""
+
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from core.index_log import LoggedIndex
+
+WORD_RE = re.compile(r"\w+")
+MIN_WORD_LENGTH = 2
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Casefolded words of a text, without markup and one-letter words."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return [
+        word.strip("_")
+        for word in WORD_RE.findall(text)
+        if len(word.strip("_")) >= MIN_WORD_LENGTH
+    ]
+
+
+def post_words(post):
+    """The words a post is found by."""
+    parts = [post.get("needs", ""), post.get("text", "")]
+    parts.extend(post.get("hashtags", []))
+    return tokenize("\n".join(str(part) for part in parts if part))
+
+
+class TextIndex(LoggedIndex):
+    """Term -> {message_id: frequency} postings with BM25 ranking."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    def clear(self):
+        self.postings = {}
+        self.lengths = {}
+        self.total_length = 0
+        super().clear()
+
+    def build(self, documents):
+        """Rebuild the index from every post of the data table."""
+        self.clear()
+        for doc in documents:
+            if doc.get("message_id") is not None:
+                self._add(doc["message_id"], Counter(post_words(doc)))
+
+    def add(self, message_id, post):
+        """Index one post. Adding an already indexed post is a no-op."""
+        if message_id in self.lengths:
+            return
+        counts = Counter(post_words(post))
+        self._add(message_id, counts)
+        self.pending.append({"add": message_id, "words": counts})
+
+    def remove(self, message_id, post):
+        """Drop a post, given the version of it that was indexed."""
+        if message_id not in self.lengths:
+            return
+        words = sorted(set(post_words(post)))
+        self._remove(message_id, words)
+        self.pending.append({"remove": message_id, "words": words})
+
+    def _add(self, message_id, counts):
+        self.lengths[message_id] = sum(counts.values())
+        self.total_length += self.lengths[message_id]
+        for word, count in counts.items():
+            self.postings.setdefault(word, {})[message_id] = count
+
+    def _remove(self, message_id, words):
+        for word in words:
+            docs = self.postings.get(word)
+            if docs is None:
+                continue
+            docs.pop(message_id, None)
+            if not docs:
+                del self.postings[word]
+        self.total_length -= self.lengths.pop(message_id)
+
+    def _indexed(self, message_id):
+        return message_id in self.lengths
+
+    def _replay_add(self, record):
+        self._add(record["add"], record["words"])
+
+    def _replay_remove(self, record):
+        self._remove(record["remove"], record["words"])
+
+    def _restore(self, raw):
+        # JSON object keys are strings, message ids are ints
+        self.postings = {
+            word: {int(m): tf for m, tf in docs.items()}
+            for word, docs in raw.get("postings", {}).items()
+        }
+        self.lengths = {int(m): n for m, n in raw.get("lengths", {}).items()}
+        self.total_length = sum(self.lengths.values())
+
+    def _payload(self):
+        return {"postings": self.postings, "lengths": self.lengths}
+
+    def search(self, query, limit=None):
+        """
+        Message ids of the posts containing any word of the query, best
+        BM25 score first (newest first on ties).
+        """
+        words = set(tokenize(query))
+        documents = len(self.lengths)
+        if not words or not documents:
+            return []
+        average_length = self.total_length / documents or 1
+
+        scores = Counter()
+        for word in words:
+            docs = self.postings.get(word)
+            if not docs:
+                continue
+            idf = math.log(1 + (documents - len(docs) + 0.5) / (len(docs) + 0.5))
+            for message_id, tf in docs.items():
+                norm = K1 * (1 - B + B * self.lengths[message_id] / average_length)
+                scores[message_id] += idf * tf * (K1 + 1) / (tf + norm)
+
+        ranked = ((score, message_id) for message_id, score in scores.items())
+        if limit is not None:
+            return [m for _, m in heapq.nlargest(limit, ranked)]
+        return [m for _, m in sorted(ranked, reverse=True)]
+
+
+text_index = TextIndex("data_json/text_index.json")
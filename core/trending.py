@@ -0,0 +1,192 @@
+"""
+Trending hashtags over the last 24 hours, 7 days and 30 days.
+
+Post hashtags are counted in hourly buckets of a ring buffer that covers
+the longest window. Every window keeps a running Counter: a post adds to
+the windows its date falls in and an hour is subtracted again when it
+slides out, so asking for the trending hashtags never sums the buckets.
+
+The counts start from the stored posts of the last 30 days and are fed by
+the listener and scrape_all afterwards. Posts stored by another process are
+picked up by rereading them, at most every RELOAD_INTERVAL seconds and only
+when the post table changed.
+"""
+
+import datetime
+import threading
+import time
+from collections import Counter
+
+from core.hashtags import hashtag_aliases
+from core.repository import get_repository
+
+HOUR = 3600
+WINDOWS = {"24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+RELOAD_INTERVAL = 60  # seconds
+
+
+def hour_of(date):
+    """Hour number of an ISO date string or datetime, None if unknown."""
+    if isinstance(date, str):
+        try:
+            date = datetime.datetime.fromisoformat(date)
+        except ValueError:
+            return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.astimezone()
+    return int(date.timestamp() // HOUR)
+
+
+def current_hour():
+    return hour_of(datetime.datetime.now(datetime.timezone.utc))
+
+
+class TrendingHashtags:
+    """Hourly ring buffer of hashtag counts with running window totals."""
+
+    def __init__(
+        self, repository=None, windows=WINDOWS, reload_interval=RELOAD_INTERVAL
+    ):
+        self.repository = repository
+        self.windows = dict(windows)
+        self.size = max(self.windows.values())
+        self.reload_interval = reload_interval
+        self.version = 0
+        self.loaded = False
+        # Version of the stored post table the counts were read at
+        self.posts_version = None
+        self.loaded_at = None
+        self.lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.buckets = [Counter() for _ in range(self.size)]
+        self.bucket_hours = [None] * self.size
+        self.totals = {name: Counter() for name in self.windows}
+        self.seen = {}
+        self.hour = None
+
+    def _load(self, reload=False):
+        """Count the stored posts, again when reload is set and they changed."""
+        if self.loaded and not (reload and self._stale()):
+            return
+        with self.lock:
+            if self.loaded and not (reload and self._stale()):
+                return
+            if self.repository is None:
+                self.repository = get_repository()
+            self._clear()
+            self.loaded = True
+            self.posts_version = self.repository.version("posts")
+            self.loaded_at = time.monotonic()
+            self._advance(current_hour())
+            for post in self.repository.all_posts():
+                self._add(
+                    post.get("message_id"), post.get("date"), post.get("hashtags")
+                )
+            self.version += 1
+
+    def _stale(self):
+        # Rereading is linear in the posts, so it waits for reload_interval
+        if time.monotonic() - self.loaded_at < self.reload_interval:
+            return False
+        return self.repository.version("posts") != self.posts_version
+
+    def _advance(self, hour):
+        """Slide every window forward to end at hour."""
+        if self.hour is None:
+            self.hour = hour
+            return
+        if hour <= self.hour:
+            return
+        # Hours in between only matter if they are still inside a window
+        start = max(self.hour + 1, hour - self.size + 1)
+        for h in range(start, hour + 1):
+            for name, length in self.windows.items():
+                expired = h - length
+                slot = expired % self.size
+                if self.bucket_hours[slot] == expired:
+                    self.totals[name].subtract(self.buckets[slot])
+            slot = h % self.size
+            if self.bucket_hours[slot] is not None:
+                self.buckets[slot] = Counter()
+                self.bucket_hours[slot] = None
+        if hour - self.hour >= self.size:
+            for total in self.totals.values():
+                total.clear()
+        for total in self.totals.values():
+            total += Counter()  # drop hashtags that reached zero
+        self.seen = {m: h for m, h in self.seen.items() if h > hour - self.size}
+        self.hour = hour
+        self.version += 1
+
+    def _add(self, message_id, date, hashtags):
+        hour = hour_of(date)
+        if hour is None or not hashtags or hour > self.hour:
+            return
+        if hour <= self.hour - self.size or message_id in self.seen:
+            return
+        if message_id is not None:
+            self.seen[message_id] = hour
+        slot = hour % self.size
+        if self.bucket_hours[slot] != hour:
+            self.buckets[slot] = Counter()
+            self.bucket_hours[slot] = hour
+        # Posts stored before aliases may still carry raw hashtags
+        tags = set(hashtag_aliases.canonical_all(hashtags))
+        self.buckets[slot].update(tags)
+        for name, length in self.windows.items():
+            if hour > self.hour - length:
+                self.totals[name].update(tags)
+        self.version += 1
+
+    def _remove(self, message_id, hashtags):
+        hour = self.seen.pop(message_id, None)
+        if hour is None or not hashtags or hour <= self.hour - self.size:
+            return
+        tags = Counter(hashtag_aliases.canonical_all(hashtags))
+        slot = hour % self.size
+        if self.bucket_hours[slot] == hour:
+            self.buckets[slot].subtract(tags)
+        for name, length in self.windows.items():
+            if hour > self.hour - length:
+                self.totals[name].subtract(tags)
+                self.totals[name] += Counter()  # drop hashtags that reached zero
+        self.version += 1
+
+    def remove(self, message_id, hashtags):
+        """Take back the counts of a post, given the hashtags it was added with."""
+        self._load()
+        with self.lock:
+            self._advance(current_hour())
+            self._remove(message_id, hashtags)
+
+    def add(self, message_id, date, hashtags):
+        """Count the hashtags of a post once, in the hour it was posted."""
+        self._load()
+        with self.lock:
+            self._advance(current_hour())
+            self._add(message_id, date, hashtags)
+
+    def top(self, window, n=10):
+        """The n most used hashtags of a window as (hashtag, count)."""
+        self._load(reload=True)
+        with self.lock:
+            self._advance(current_hour())
+            return self.totals[window].most_common(n)
+
+    def refresh(self):
+        """
+        Slide the windows to the current hour and pick up posts stored by
+        other processes, return the version.
+        """
+        self._load(reload=True)
+        with self.lock:
+            self._advance(current_hour())
+            return self.version
+
+
+# Process-wide trending counts shared by the listener and the bot handlers
+trending = TrendingHashtags()
@@ -1,111 +1,59 @@
 from bot.my_bot import main
 
 import telegram
-from tinydb import Query, TinyDB
 
-from core.getting_data import to_text
+from core.outbox import outbox
+from core.post_index import post_index
+from core.repository import get_repository
+from core.subscription_index import subscription_index
 from telegram import Bot, Update
 from telegram.ext import Application
 from dotenv import load_dotenv
 import os
 import asyncio
 
-userdb = TinyDB("data_json/user.json", indent=4, separators=(",", ": "))
-datadb = TinyDB(
-    "data_json/data.json", indent=4, separators=(",", ": "), encoding="utf-8"
-)
-
-Data = Query()
-data = datadb.table("data")
-User = Query()
-user_table = userdb.table("user")
-
 load_dotenv()
 token = os.getenv("BOT_TOKEN")
 
 bot = Bot(token=token)
 
 
-async def send_data() -> None:
+async def send_data(repository=None) -> None:
     """Send a message according to all users hashtags."""
+    repository = repository or get_repository()
     # get users ids and hashtags
-    users = user_table.all()
+    users = repository.all_users()
+
+    # One read of the data table for the whole digest, matching goes
+    # through the hashtag posting lists
+    post_index.sync(repository)
+    posts = {doc.get("message_id"): doc for doc in repository.all_posts()}
+
+    # Resume a digest that was interrupted before queuing anything new
+    outbox.recover(repository)
+    futures = await outbox.drain_once(bot, repository)
+
+    # post -> users, so every post is rendered and recorded once
+    recipients = {}
     for user in users:
-        user_hashtags = user["hashtags"]
-        match_mode = user.get("match_mode", "any")
-
-        # Search based on user's match mode preference
-        if match_mode == "advanced":
-            # Advanced mode: (ALL required) AND (ANY optional)
-            required_tags = user.get("required_hashtags", [])
-            optional_tags = user.get("optional_hashtags", [])
-
-            # Get all data first
-            all_data = data.all()
-            search = []
-
-            for item in all_data:
-                item_hashtags = item.get("hashtags", [])
-
-                # Check required hashtags (all must be present)
-                required_match = (
-                    all(tag in item_hashtags for tag in required_tags)
-                    if required_tags
-                    else True
-                )
-
-                # Check optional hashtags (at least one must be present)
-                optional_match = (
-                    any(tag in item_hashtags for tag in optional_tags)
-                    if optional_tags
-                    else True
-                )
-
-                # Both conditions must be met
-                if required_match and optional_match:
-                    search.append(item)
-        elif match_mode == "all":
-            # User wants messages with ALL their hashtags
-            search = data.search(Data.hashtags.all(user_hashtags))
-        else:
-            # User wants messages with ANY of their hashtags (default)
-            search = data.search(Data.hashtags.any(user_hashtags))
-
-        if len(search) == 0:
-            continue
-        for dct in search:
-            from core.getting_data import (
-                clean_markdown_for_telegram,
-                remove_all_markdown,
-            )
-
-            text = to_text(dct)
-            cleaned_text = clean_markdown_for_telegram(str(text))
-            try:
-                try:
-                    await bot.send_message(
-                        chat_id=user["id"],
-                        text=cleaned_text,
-                        parse_mode=telegram.constants.ParseMode.MARKDOWN,
-                    )
-                except telegram.error.BadRequest as parse_error:
-                    # If markdown parsing fails, send as plain text
-                    plain_text = remove_all_markdown(str(text))
-                    await bot.send_message(chat_id=user["id"], text=plain_text)
-                    print(
-                        f"Sent plain text message to user {user['id']} due to markdown error"
-                    )
-                    continue
-                await asyncio.sleep(5)  # Add a delay of 1 second between messages
-            except telegram.error.RetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                continue
-            except Exception as e:
-                continue
-
-
-async def send_new_message(message_data: dict) -> None:
+        for message_id in post_index.search(user):
+            if message_id in posts:
+                recipients.setdefault(message_id, []).append(user["id"])
+
+    # The outbox skips (user, post) pairs that were already delivered
+    for message_id in sorted(recipients):
+        futures += await outbox.deliver(
+            bot, repository, posts[message_id], recipients[message_id]
+        )
+
+    # Wait until the scheduler delivered the whole digest
+    results = await outbox.wait(repository, futures)
+    print(f"Sent {sum(results)}/{len(results)} digest messages")
+
+
+async def send_new_message(message_data: dict, repository=None) -> None:
     """Send a new message to users who have matching hashtags."""
+    repository = repository or get_repository()
     if not message_data or "hashtags" not in message_data:
         return
 
@@ -113,98 +61,24 @@ async def send_new_message(message_data: dict) -> None:
     if not message_hashtags:
         return
 
-    # Get all users
-    users = user_table.all()
+    # Only users subscribed to one of the post's hashtags are candidates
+    users_version = repository.version("users")
+    if subscription_index.stale(users_version):
+        subscription_index.build(repository.all_users(), users_version)
+    matched_ids = subscription_index.match(message_hashtags)
+    if not matched_ids:
+        return
+
+    # Recorded in the outbox before sending, so a restart resumes here
+    futures = await outbox.deliver(bot, repository, message_data, matched_ids)
+    results = await outbox.wait(repository, futures)
+    print(
+        f"Sent new message {message_data.get('message_id')} to "
+        f"{sum(results)}/{len(results)} users"
+    )
 
-    for user in users:
-        user_hashtags = user.get("hashtags", [])
-        if not user_hashtags:
-            continue
-
-        # Get user's matching preference (default to "any")
-        match_mode = user.get("match_mode", "any")  # "any", "all", or "advanced"
-
-        # Check based on user preference
-        if match_mode == "advanced":
-            # Advanced mode: (ALL required) AND (ANY optional)
-            required_tags = user.get("required_hashtags", [])
-            optional_tags = user.get("optional_hashtags", [])
-
-            # Check if all required hashtags are present
-            required_match = (
-                all(hashtag in message_hashtags for hashtag in required_tags)
-                if required_tags
-                else True
-            )
-
-            # Check if any optional hashtag is present
-            optional_match = (
-                any(hashtag in message_hashtags for hashtag in optional_tags)
-                if optional_tags
-                else True
-            )
-
-            # Both conditions must be true
-            has_matching_hashtag = required_match and optional_match
-
-        elif match_mode == "all":
-            # User wants ALL their hashtags to be present in the message
-            has_matching_hashtag = all(
-                hashtag in message_hashtags for hashtag in user_hashtags
-            )
-        else:
-            # User wants ANY of their hashtags to be present in the message (default)
-            has_matching_hashtag = any(
-                hashtag in message_hashtags for hashtag in user_hashtags
-            )
-
-        if has_matching_hashtag:
-            try:
-                from core.getting_data import (
-                    clean_markdown_for_telegram,
-                    remove_all_markdown,
-                )
-
-                text = to_text(message_data)
-                cleaned_text = clean_markdown_for_telegram(str(text))
-
-                try:
-                    await bot.send_message(
-                        chat_id=user["id"],
-                        text=cleaned_text,
-                        parse_mode=telegram.constants.ParseMode.MARKDOWN,
-                    )
-                except telegram.error.BadRequest as parse_error:
-                    # If markdown parsing fails, send as plain text
-                    plain_text = remove_all_markdown(str(text))
-                    await bot.send_message(chat_id=user["id"], text=plain_text)
-                    print(
-                        f"Sent plain text message to user {user['id']} due to markdown error"
-                    )
-                    return
-
-                await asyncio.sleep(1)  # Add a delay between messages
-                print(f"Sent new message to user {user['id']}")
-            except telegram.error.RetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                # Retry sending
-                try:
-                    await bot.send_message(
-                        chat_id=user["id"],
-                        text=cleaned_text,
-                        parse_mode=telegram.constants.ParseMode.MARKDOWN,
-                    )
-                    print(f"Retry successful: Sent message to user {user['id']}")
-                except Exception as retry_e:
-                    print(
-                        f"Failed to send message to user {user['id']} after retry: {retry_e}"
-                    )
-            except Exception as e:
-                print(f"Failed to send message to user {user['id']}: {e}")
-                continue
-
-
-async def run_bot_async() -> None:
+
+async def run_bot_async(repository=None) -> None:
     """Run the bot asynchronously."""
     from telegram.ext import Application
     from bot.my_bot import handler
@@ -212,7 +86,7 @@ async def run_bot_async() -> None:
     # Create the Application and pass it your bot's token.
     application = Application.builder().token(token).build()
 
-    application = handler(application)
+    application = handler(application, repository)
 
     # Start polling asynchronously
     await application.initialize()
@@ -235,17 +109,27 @@ async def run_both() -> None:
     """Run both the bot and the listener concurrently."""
     from bot.scraping import start_listening
 
+    # One repository for the bot handlers, the listener and the sender
+    repository = get_repository()
+
     # Create tasks for both async functions
-    bot_task = asyncio.create_task(run_bot_async())
-    listener_task = asyncio.create_task(start_listening())
+    bot_task = asyncio.create_task(run_bot_async(repository))
+    listener_task = asyncio.create_task(start_listening(repository))
+    # Resumes deliveries left in the outbox by a previous run
+    outbox_task = asyncio.create_task(outbox.run(bot, repository))
 
-    # Run both tasks concurrently
-    await asyncio.gather(bot_task, listener_task)
+    # Run all tasks concurrently
+    await asyncio.gather(bot_task, listener_task, outbox_task)
 
 
 if __name__ == "__main__":
     if "send_data" in os.sys.argv:
         asyncio.run(send_data())
+    elif "migrate" in os.sys.argv:
+        # One-shot import of the data_json/*.json files into SQLite
+        from core.storage import migrate_json_to_sqlite
+
+        migrate_json_to_sqlite()
     elif "hashtags" in os.sys.argv:
         from bot.scraping import run_hashtags
 